@@ -0,0 +1,32 @@
+IO_BUF = 1 << 20
+
+try:
+    from orjson import OPT_APPEND_NEWLINE, dumps, loads
+
+    def dumps_line(obj):
+        return dumps(obj, option=OPT_APPEND_NEWLINE)
+except ImportError:
+    import json
+
+    _encode = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False).encode
+    loads = json.loads
+
+    def dumps(obj):
+        return _encode(obj).encode()
+
+    def dumps_line(obj):
+        return (_encode(obj) + '\n').encode()
+
+def encode_record(key, value):
+    return dumps_line({'k': key, 'v': value})
+
+def decode_record(line):
+    record = loads(line)
+    return record['k'], record['v']
+
+def encode_framed(key, value):
+    return dumps(key) + b'\t' + dumps_line(value)
+
+def decode_framed(line):
+    key, _, value = line.partition(b'\t')
+    return loads(key), loads(value)
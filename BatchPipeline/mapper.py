@@ -1,107 +1,209 @@
 import os
+import re
 import json
-import hashlib
-import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import Callable, Iterator, Tuple, Any
+from codec import IO_BUF, encode_framed, encode_record
+from spill import PackedFile, PartitionFiles, SegmentFile
+
+PARTITION_FLUSH_SIZE = 256 * 1024
+WORD_COUNT_BLOCK_SIZE = 16 * 1024 * 1024
 
 class Mapper:
-    def __init__(self, map_func: Callable, num_partitions: int = 4, output_dir: str = 'map_output'):
+    def __init__(self, map_func: Callable, num_partitions: int = 4, output_dir: str = 'map_output', use_framed: bool = True, single_file: bool = False, packed: bool = False):
         self.map_func = map_func
         self.num_partitions = num_partitions
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.use_framed = use_framed
+        self.encode = encode_framed if use_framed else encode_record
+        self.sink_cls = PackedFile if packed else SegmentFile if single_file else PartitionFiles
+        self._mask = num_partitions - 1 if num_partitions & (num_partitions - 1) == 0 else None
+
+    def _partition(self, key_bytes: bytes) -> int:
+        if self._mask is not None:
+            return zlib.crc32(key_bytes) & self._mask
+        return zlib.crc32(key_bytes) % self.num_partitions
 
-    def _partition(self, key: str) -> int:
-        return int(hashlib.md5(key.encode()).hexdigest(), 16) % self.num_partitions
+    def _open_sink(self, task_id: str):
+        return self.sink_cls(self.output_dir, task_id, self.num_partitions)
+
+    def _flush_bufs(self, sink, bufs: list):
+        for partition, buf in enumerate(bufs):
+            if buf:
+                sink.write(partition, buf)
 
     def process_file(self, input_path: str, task_id: str) -> dict:
-        partition_files = {}
-        for i in range(self.num_partitions):
-            path = self.output_dir / f'{task_id}_partition_{i}.json'
-            partition_files[i] = open(path, 'w')
+        sink = self._open_sink(task_id)
+        record_count = self._write_file(sink, input_path)
+        sink.close()
+
+        return {
+            'task_id': task_id,
+            'input': input_path,
+            'records': record_count,
+            'partitions': sink.refs()
+        }
+
+    def open_outputs(self, name: str):
+        self._outputs = SegmentFile(self.output_dir, name, self.num_partitions)
 
+    def append_file(self, input_path: str, task_id: str) -> dict:
+        outputs = self._outputs
+        first_extent = outputs.extent_count()
+        record_count = self._write_file(outputs, input_path)
+
+        return {
+            'task_id': task_id,
+            'input': input_path,
+            'records': record_count,
+            'partitions': outputs.refs(first_extent)
+        }
+
+    def push_file(self, input_path: str, task_id: str, shuffle) -> dict:
+        return {
+            'task_id': task_id,
+            'input': input_path,
+            'records': self._write_file(shuffle, input_path)
+        }
+
+    def close_outputs(self):
+        self._outputs.close()
+
+    def _write_file(self, sink, input_path: str) -> int:
+        bufs = [bytearray() for _ in range(self.num_partitions)]
+
+        encode = self.encode
         record_count = 0
-        with open(input_path) as f:
+        with open(input_path, buffering=IO_BUF) as f:
             for line in f:
                 line = line.strip()
                 if not line:
                     continue
 
                 for key, value in self.map_func(line):
-                    partition = self._partition(key)
-                    partition_files[partition].write(json.dumps({'k': key, 'v': value}) + '\n')
+                    partition = self._partition(key.encode())
+                    buf = bufs[partition]
+                    buf += encode(key, value)
+                    if len(buf) >= PARTITION_FLUSH_SIZE:
+                        sink.write(partition, buf)
+                        buf.clear()
                     record_count += 1
 
-        for f in partition_files.values():
-            f.close()
-
-        return {
-            'task_id': task_id,
-            'input': input_path,
-            'records': record_count,
-            'partitions': [str(self.output_dir / f'{task_id}_partition_{i}.json') for i in range(self.num_partitions)]
-        }
+        self._flush_bufs(sink, bufs)
+        return record_count
 
     def process_records(self, records: Iterator, task_id: str) -> dict:
-        partition_files = {}
-        for i in range(self.num_partitions):
-            path = self.output_dir / f'{task_id}_partition_{i}.json'
-            partition_files[i] = open(path, 'w')
+        sink = self._open_sink(task_id)
+        bufs = [bytearray() for _ in range(self.num_partitions)]
 
+        encode = self.encode
         record_count = 0
         for record in records:
             for key, value in self.map_func(record):
-                partition = self._partition(key)
-                partition_files[partition].write(json.dumps({'k': key, 'v': value}) + '\n')
+                partition = self._partition(key.encode())
+                buf = bufs[partition]
+                buf += encode(key, value)
+                if len(buf) >= PARTITION_FLUSH_SIZE:
+                    sink.write(partition, buf)
+                    buf.clear()
                 record_count += 1
 
-        for f in partition_files.values():
-            f.close()
+        self._flush_bufs(sink, bufs)
+        sink.close()
 
         return {
             'task_id': task_id,
             'records': record_count,
-            'partitions': [str(self.output_dir / f'{task_id}_partition_{i}.json') for i in range(self.num_partitions)]
+            'partitions': sink.refs()
         }
 
+class MergingMapperGroup:
+    def __init__(self, mapper: Mapper, sink):
+        self.mapper = mapper
+        self.sink = sink
+
+    def process(self, tasks: list) -> list:
+        return [self.mapper.push_file(input_path, task_id, self.sink) for input_path, task_id in tasks]
+
+class WordCountMapper(Mapper):
+    def __init__(self, map_func: Callable = None, num_partitions: int = 4, output_dir: str = 'map_output', use_framed: bool = True, single_file: bool = False, packed: bool = False):
+        super().__init__(map_func or word_count_map, num_partitions, output_dir, use_framed, single_file, packed)
+
+    def _write_file(self, sink, input_path: str) -> int:
+        if not self.use_framed:
+            return super()._write_file(sink, input_path)
+
+        partition = self._partition
+        partition_of = {}
+        record_count = 0
+        with open(input_path, buffering=IO_BUF) as f:
+            while True:
+                block = f.readlines(WORD_COUNT_BLOCK_SIZE)
+                if not block:
+                    break
+
+                words = _NON_WORD_RE.sub('', ''.join(block).lower()).split()
+                groups = [[] for _ in range(self.num_partitions)]
+                appends = [group.append for group in groups]
+                for word in words:
+                    i = partition_of.get(word)
+                    if i is None:
+                        i = partition_of[word] = partition(word.encode())
+                    appends[i](word)
+
+                for i, group in enumerate(groups):
+                    if group:
+                        sink.write(i, ('"' + '"\t1\n"'.join(group) + '"\t1\n').encode())
+                record_count += len(words)
+
+        return record_count
+
 class CombiningMapper(Mapper):
-    def __init__(self, map_func: Callable, combine_func: Callable, num_partitions: int = 4, output_dir: str = 'map_output'):
-        super().__init__(map_func, num_partitions, output_dir)
+    def __init__(self, map_func: Callable, combine_func: Callable = None, num_partitions: int = 4, output_dir: str = 'map_output', use_framed: bool = True, combine_mode: str = 'custom', single_file: bool = False):
+        super().__init__(map_func, num_partitions, output_dir, use_framed, single_file)
         self.combine_func = combine_func
+        self.combine_mode = combine_mode
 
-    def process_file(self, input_path: str, task_id: str) -> dict:
+    def _write_file(self, sink, input_path: str) -> int:
         partition_buffers = {i: {} for i in range(self.num_partitions)}
+        mode = self.combine_mode
+        combine_func = self.combine_func
 
-        with open(input_path) as f:
+        with open(input_path, buffering=IO_BUF) as f:
             for line in f:
                 line = line.strip()
                 if not line:
                     continue
 
                 for key, value in self.map_func(line):
-                    partition = self._partition(key)
-                    buffer = partition_buffers[partition]
+                    buffer = partition_buffers[self._partition(key.encode())]
 
-                    if key in buffer:
-                        buffer[key] = self.combine_func(key, [buffer[key], value])
-                    else:
+                    if mode == 'sum':
+                        buffer[key] = buffer.get(key, 0) + value
+                    elif key not in buffer:
                         buffer[key] = value
+                    elif mode == 'max':
+                        if value > buffer[key]:
+                            buffer[key] = value
+                    else:
+                        buffer[key] = combine_func(key, [buffer[key], value])
 
+        encode = self.encode
         record_count = 0
         for i in range(self.num_partitions):
-            path = self.output_dir / f'{task_id}_partition_{i}.json'
-            with open(path, 'w') as f:
-                for key, value in sorted(partition_buffers[i].items()):
-                    f.write(json.dumps({'k': key, 'v': value}) + '\n')
-                    record_count += 1
+            items = partition_buffers[i].items()
+            if self.use_framed:
+                lines = sorted(encode(key, value) for key, value in items)
+            else:
+                lines = [encode(key, value) for key, value in sorted(items)]
+            if lines:
+                sink.write(i, b''.join(lines))
+            record_count += len(lines)
 
-        return {
-            'task_id': task_id,
-            'input': input_path,
-            'records': record_count,
-            'partitions': [str(self.output_dir / f'{task_id}_partition_{i}.json') for i in range(self.num_partitions)]
-        }
+        return record_count
 
 class ParallelMapper:
     def __init__(self, map_func: Callable, num_partitions: int = 4, num_workers: int = 4, output_dir: str = 'map_output'):
@@ -111,45 +213,38 @@ class ParallelMapper:
         self.output_dir = Path(output_dir)
 
     def process_files(self, input_files: list) -> list:
-        results = []
-        threads = []
-        lock = threading.Lock()
-
-        def worker(files):
-            mapper = Mapper(self.map_func, self.num_partitions, str(self.output_dir))
-            for i, path in enumerate(files):
-                task_id = f'map_{hash(path) % 10000:04d}'
-                result = mapper.process_file(path, task_id)
-                with lock:
-                    results.append(result)
-
-        chunk_size = (len(input_files) + self.num_workers - 1) // self.num_workers
-        chunks = [input_files[i:i + chunk_size] for i in range(0, len(input_files), chunk_size)]
-
-        for chunk in chunks:
-            t = threading.Thread(target=worker, args=(chunk,))
-            threads.append(t)
-            t.start()
+        tasks = [
+            (f'worker_{i}', list(enumerate(input_files))[i::self.num_workers], self.map_func, self.num_partitions, str(self.output_dir))
+            for i in range(min(self.num_workers, len(input_files)))
+        ]
+        results = [None] * len(input_files)
+        with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+            for worker_results in executor.map(_map_worker, tasks):
+                for i, result in worker_results:
+                    results[i] = result
+        return results
 
-        for t in threads:
-            t.join()
+def _map_worker(task: tuple) -> list:
+    name, files, map_func, num_partitions, output_dir = task
+    mapper = Mapper(map_func, num_partitions, output_dir)
+    mapper.open_outputs(name)
+    try:
+        return [(i, mapper.append_file(path, f'map_{hash(path) % 10000:04d}')) for i, path in files]
+    finally:
+        mapper.close_outputs()
 
-        return results
+_NON_WORD_RE = re.compile(r'[^\w\s]|_')
 
 def word_count_map(line: str) -> Iterator[Tuple[str, int]]:
-    for word in line.lower().split():
-        word = ''.join(c for c in word if c.isalnum())
-        if word:
-            yield (word, 1)
+    for word in _NON_WORD_RE.sub('', line.lower()).split():
+        yield (word, 1)
 
 def inverted_index_map(line: str) -> Iterator[Tuple[str, str]]:
     parts = line.split('\t', 1)
     if len(parts) == 2:
         doc_id, content = parts
-        for word in content.lower().split():
-            word = ''.join(c for c in word if c.isalnum())
-            if word:
-                yield (word, doc_id)
+        for word in _NON_WORD_RE.sub('', content.lower()).split():
+            yield (word, doc_id)
 
 def url_count_map(line: str) -> Iterator[Tuple[str, int]]:
     try:
@@ -1,14 +1,15 @@
 import os
-import json
 import shutil
 import time
 from pathlib import Path
 from typing import Callable, List
 from dataclasses import dataclass
 
-from mapper import Mapper, word_count_map, ParallelMapper
+from mapper import Mapper, MergingMapperGroup, WordCountMapper, word_count_map, ParallelMapper
 from reducer import Reducer, sum_reduce
 from scheduler import JobScheduler, WorkerPool, Task
+from spill import ShuffleService
+from codec import loads
 
 @dataclass
 class JobConfig:
@@ -20,6 +21,8 @@ class JobConfig:
     num_mappers: int = 4
     num_reducers: int = 2
     num_partitions: int = 4
+    map_group_size: int = 4
+    mapper_cls: type = Mapper
 
 class MapReduceJob:
     def __init__(self, config: JobConfig):
@@ -53,26 +56,26 @@ class MapReduceJob:
 
     def _run_map_phase(self) -> List[dict]:
         results = []
-
-        for i, input_path in enumerate(self.config.input_paths):
-            mapper = Mapper(
-                self.config.map_func,
-                num_partitions=self.config.num_partitions,
-                output_dir=str(self.map_output)
-            )
-            result = mapper.process_file(input_path, f'map_{i:04d}')
-            results.append(result)
+        self.shuffle = ShuffleService(self.map_output, self.config.num_partitions)
+
+        tasks = [(input_path, f'map_{i:04d}') for i, input_path in enumerate(self.config.input_paths)]
+        group_size = self.config.map_group_size
+        try:
+            for start in range(0, len(tasks), group_size):
+                mapper = self.config.mapper_cls(
+                    self.config.map_func,
+                    num_partitions=self.config.num_partitions,
+                    output_dir=str(self.map_output)
+                )
+                group = MergingMapperGroup(mapper, self.shuffle)
+                results += group.process(tasks[start:start + group_size])
+        finally:
+            self.shuffle.close()
 
         return results
 
     def _shuffle(self, map_results: List[dict]) -> dict:
-        partition_files = {i: [] for i in range(self.config.num_partitions)}
-
-        for result in map_results:
-            for i, path in enumerate(result['partitions']):
-                partition_files[i].append(path)
-
-        return partition_files
+        return {i: [path] for i, path in enumerate(self.shuffle.refs())}
 
     def _run_reduce_phase(self, partition_files: dict) -> List[dict]:
         results = []
@@ -115,12 +118,13 @@ class DistributedMapReduceJob:
         map_pool = WorkerPool(
             self.num_workers,
             map_scheduler,
-            map_func=self.config.map_func
+            map_func=self.config.map_func,
+            mapper_cls=self.config.mapper_cls,
+            num_partitions=self.config.num_partitions
         )
         map_pool.start()
 
-        while not map_scheduler.all_complete():
-            time.sleep(0.1)
+        map_scheduler.wait_complete()
 
         map_pool.stop()
 
@@ -150,8 +154,7 @@ class DistributedMapReduceJob:
         )
         reduce_pool.start()
 
-        while not reduce_scheduler.all_complete():
-            time.sleep(0.1)
+        reduce_scheduler.wait_complete()
 
         reduce_pool.stop()
 
@@ -208,7 +211,8 @@ def run_word_count():
         output_dir=str(test_dir / 'output'),
         map_func=word_count_map,
         reduce_func=sum_reduce,
-        num_partitions=2
+        num_partitions=2,
+        mapper_cls=WordCountMapper
     )
 
     job = MapReduceJob(config)
@@ -220,7 +224,7 @@ def run_word_count():
         print(f'\n{path.name}:')
         with open(path) as f:
             for line in f:
-                record = json.loads(line)
+                record = loads(line)
                 print(f'  {record["k"]}: {record["v"]}')
 
 if __name__ == '__main__':
@@ -1,40 +1,43 @@
 import os
 import json
 import heapq
+import shutil
+import subprocess
 from pathlib import Path
 from typing import Callable, Iterator, Tuple, Any, List
+from codec import IO_BUF, decode_framed, decode_record, encode_record, loads
+from spill import exists, iter_lines, read_lines, split_ref
+
+def _split_framed(line):
+    key, _, value = line.partition(b'\t')
+    return key, value
 
 class Reducer:
-    def __init__(self, reduce_func: Callable, output_dir: str = 'reduce_output'):
+    def __init__(self, reduce_func: Callable, output_dir: str = 'reduce_output', use_framed: bool = True, presorted: bool = False, accumulator: Callable = None, init: Any = 0):
         self.reduce_func = reduce_func
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.use_framed = use_framed
+        self.presorted = presorted
+        self.accumulator = accumulator
+        self.init = init
+        self.decode = decode_framed if use_framed else decode_record
 
     def process_partition(self, partition_files: List[str], partition_id: int) -> dict:
         output_path = self.output_dir / f'part_{partition_id:04d}.json'
 
-        sorted_records = self._merge_sort(partition_files)
+        builtin = _BUILTIN_REDUCERS.get(self.reduce_func)
+        if self.accumulator is not None:
+            results = self._accumulated(partition_files)
+        elif builtin is not None:
+            results = ((key, builtin(values)) for key, values in self._grouped_records(partition_files))
+        else:
+            results = ((key, self.reduce_func(key, values)) for key, values in self._grouped_records(partition_files))
 
         record_count = 0
-        with open(output_path, 'w') as out:
-            current_key = None
-            current_values = []
-
-            for key, value in sorted_records:
-                if key != current_key:
-                    if current_key is not None:
-                        result = self.reduce_func(current_key, current_values)
-                        out.write(json.dumps({'k': current_key, 'v': result}) + '\n')
-                        record_count += 1
-
-                    current_key = key
-                    current_values = [value]
-                else:
-                    current_values.append(value)
-
-            if current_key is not None:
-                result = self.reduce_func(current_key, current_values)
-                out.write(json.dumps({'k': current_key, 'v': result}) + '\n')
+        with open(output_path, 'wb', buffering=IO_BUF) as out:
+            for key, result in results:
+                out.write(encode_record(key, result))
                 record_count += 1
 
         return {
@@ -43,45 +46,128 @@ class Reducer:
             'records': record_count
         }
 
-    def _merge_sort(self, partition_files: List[str]) -> Iterator[Tuple[str, Any]]:
-        file_handles = []
+    def _grouped_records(self, partition_files: List[str]) -> Iterator[Tuple[str, List]]:
+        if self.use_framed:
+            return self._group_framed(self._merge_raw(partition_files))
+        return self._group(self._merge_sort(partition_files))
+
+    def _accumulated(self, partition_files: List[str]) -> Iterator[Tuple[str, Any]]:
+        accumulator = self.accumulator
+        init = self.init
+        current_key = None
+        acc = init
+
+        for key, value in self._merge_sort(partition_files):
+            if key != current_key:
+                if current_key is not None:
+                    yield (current_key, acc)
+
+                current_key = key
+                acc = init
+            acc = accumulator(acc, value)
+
+        if current_key is not None:
+            yield (current_key, acc)
+
+    def _group(self, records: Iterator[Tuple[str, Any]]) -> Iterator[Tuple[str, List]]:
+        current_key = None
+        current_values = []
+
+        for key, value in records:
+            if key != current_key:
+                if current_key is not None:
+                    yield (current_key, current_values)
+
+                current_key = key
+                current_values = [value]
+            else:
+                current_values.append(value)
+
+        if current_key is not None:
+            yield (current_key, current_values)
+
+    def _group_framed(self, records: Iterator[Tuple[bytes, bytes]]) -> Iterator[Tuple[str, List]]:
+        for key, values in self._group(records):
+            yield (loads(key), loads(b'[' + b','.join(values) + b']'))
+
+    def _existing(self, partition_files: List[str]) -> List[str]:
+        return [ref for ref in partition_files if exists(ref)]
+
+    def _merge_raw(self, partition_files: List[str]) -> Iterator[Tuple[bytes, bytes]]:
+        paths = self._existing(partition_files)
+        if not self.presorted:
+            return self._sorted_lines(paths)
+        if len(paths) > 1 and shutil.which('sort') and all(split_ref(ref)[1] is None for ref in paths):
+            return self._external_merge(paths)
+        return self._heap_merge(paths, _split_framed)
+
+    def _sorted_lines(self, refs: List[str]) -> Iterator[Tuple[bytes, bytes]]:
+        lines = []
+        for ref in refs:
+            lines += read_lines(ref)
+        lines.sort()
+        return map(_split_framed, lines)
+
+    def _external_merge(self, paths: List[str]) -> Iterator[Tuple[bytes, bytes]]:
+        proc = subprocess.Popen(
+            ['sort', '-m', '-t', '\t', '-k1,1'] + paths,
+            stdout=subprocess.PIPE,
+            env={**os.environ, 'LC_ALL': 'C'},
+            bufsize=IO_BUF
+        )
+        try:
+            for line in proc.stdout:
+                yield _split_framed(line)
+        finally:
+            proc.stdout.close()
+            returncode = proc.wait()
+        if returncode != 0:
+            raise RuntimeError(f'sort -m exited with status {returncode}')
+
+    def _heap_merge(self, refs: List[str], split: Callable) -> Iterator[Tuple[Any, Any]]:
+        readers = []
         heap = []
 
-        for i, path in enumerate(partition_files):
-            if os.path.exists(path):
-                f = open(path)
-                file_handles.append(f)
-                line = f.readline()
-                if line:
-                    record = json.loads(line)
-                    heapq.heappush(heap, (record['k'], record['v'], i))
+        for ref in refs:
+            lines = iter_lines(ref)
+            line = next(lines, None)
+            if line:
+                key, value = split(line)
+                heapq.heappush(heap, (key, len(readers), value))
+            readers.append(lines)
 
         while heap:
-            key, value, file_idx = heapq.heappop(heap)
+            key, reader_idx, value = heapq.heappop(heap)
             yield (key, value)
 
-            line = file_handles[file_idx].readline()
+            line = next(readers[reader_idx], None)
             if line:
-                record = json.loads(line)
-                heapq.heappush(heap, (record['k'], record['v'], file_idx))
+                key, value = split(line)
+                heapq.heappush(heap, (key, reader_idx, value))
 
-        for f in file_handles:
-            f.close()
+        for lines in readers:
+            lines.close()
+
+    def _merge_sort(self, partition_files: List[str]) -> Iterator[Tuple[str, Any]]:
+        if not self.use_framed:
+            return self._heap_merge(self._existing(partition_files), decode_record)
+        return ((loads(key), loads(value)) for key, value in self._merge_raw(partition_files))
 
 class SortingReducer(Reducer):
-    def __init__(self, reduce_func: Callable, sort_key: Callable = None, output_dir: str = 'reduce_output'):
-        super().__init__(reduce_func, output_dir)
+    def __init__(self, reduce_func: Callable, sort_key: Callable = None, output_dir: str = 'reduce_output', use_framed: bool = True):
+        super().__init__(reduce_func, output_dir, use_framed)
         self.sort_key = sort_key or (lambda x: x)
 
+    def _grouped_records(self, partition_files: List[str]) -> Iterator[Tuple[str, List]]:
+        return self._group(self._merge_sort(partition_files))
+
     def _merge_sort(self, partition_files: List[str]) -> Iterator[Tuple[str, Any]]:
         all_records = []
 
-        for path in partition_files:
-            if os.path.exists(path):
-                with open(path) as f:
-                    for line in f:
-                        record = json.loads(line)
-                        all_records.append((record['k'], record['v']))
+        for ref in partition_files:
+            if exists(ref):
+                for line in iter_lines(ref):
+                    all_records.append(self.decode(line))
 
         all_records.sort(key=lambda x: self.sort_key(x[0]))
 
@@ -125,40 +211,41 @@ def avg_reduce(key: str, values: List[float]) -> float:
 def count_reduce(key: str, values: List[Any]) -> int:
     return len(values)
 
+_BUILTIN_REDUCERS = {sum_reduce: sum, max_reduce: max, min_reduce: min, count_reduce: len}
+
 def top_n_reduce(n: int):
     def reducer(key: str, values: List[Any]) -> List:
         return sorted(values, reverse=True)[:n]
     return reducer
 
 class CombinedReducer:
-    def __init__(self, reducers: dict, output_dir: str = 'reduce_output'):
+    def __init__(self, reducers: dict, output_dir: str = 'reduce_output', use_framed: bool = True):
         self.reducers = reducers
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.decode = decode_framed if use_framed else decode_record
 
     def process(self, partition_files: List[str], partition_id: int) -> dict:
         results = {name: {} for name in self.reducers}
 
-        for path in partition_files:
-            if os.path.exists(path):
-                with open(path) as f:
-                    for line in f:
-                        record = json.loads(line)
-                        key, value = record['k'], record['v']
+        for ref in partition_files:
+            if exists(ref):
+                for line in iter_lines(ref):
+                    key, value = self.decode(line)
 
-                        for name, reduce_func in self.reducers.items():
-                            if key not in results[name]:
-                                results[name][key] = []
-                            results[name][key].append(value)
+                    for name, reduce_func in self.reducers.items():
+                        if key not in results[name]:
+                            results[name][key] = []
+                        results[name][key].append(value)
 
         outputs = {}
         for name, reduce_func in self.reducers.items():
             output_path = self.output_dir / f'{name}_part_{partition_id:04d}.json'
-            with open(output_path, 'w') as out:
+            with open(output_path, 'wb', buffering=IO_BUF) as out:
                 for key in sorted(results[name].keys()):
                     values = results[name][key]
                     result = reduce_func(key, values)
-                    out.write(json.dumps({'k': key, 'v': result}) + '\n')
+                    out.write(encode_record(key, result))
             outputs[name] = str(output_path)
 
         return {'partition_id': partition_id, 'outputs': outputs}
@@ -176,7 +263,7 @@ if __name__ == '__main__':
         f.write(json.dumps({'k': 'apple', 'v': 1}) + '\n')
         f.write(json.dumps({'k': 'cherry', 'v': 1}) + '\n')
 
-    reducer = Reducer(sum_reduce)
+    reducer = Reducer(sum_reduce, use_framed=False)
     result = reducer.process_partition(
         [str(test_dir / 'map_0.json'), str(test_dir / 'map_1.json')],
         0
@@ -1,9 +1,11 @@
+import heapq
 import threading
 import time
 import uuid
+from collections import deque
 from enum import Enum
 from dataclasses import dataclass, field
-from typing import List, Dict, Optional, Callable
+from typing import Deque, List, Dict, Optional, Callable
 from pathlib import Path
 
 class TaskState(Enum):
@@ -29,29 +31,69 @@ class Task:
 class JobScheduler:
     def __init__(self, max_retries: int = 3, task_timeout: float = 300.0):
         self.tasks: Dict[str, Task] = {}
-        self.pending_queue: List[str] = []
+        self.pending_queue: Deque[str] = deque()
+        self.state_counts: Dict[TaskState, int] = {s: 0 for s in TaskState}
+        self.completed_sum = 0.0
+        self.completed_count = 0
+        self.running_heap: List[tuple] = []
+        self.stale_running = 0
         self.max_retries = max_retries
         self.task_timeout = task_timeout
         self.lock = threading.Lock()
+        self._done = threading.Event()
+        self._done.set()
         self.workers: Dict[str, dict] = {}
         self.running = False
 
+    def _set_state(self, task: Task, state: TaskState):
+        was_running = task.state == TaskState.RUNNING
+        self.state_counts[task.state] -= 1
+        self.state_counts[state] += 1
+        task.state = state
+        if was_running:
+            self.stale_running += 1
+            if self.stale_running * 2 > len(self.running_heap):
+                self._compact_running()
+        self._update_done()
+
+    def _compact_running(self):
+        tasks = self.tasks
+        self.running_heap[:] = [
+            (start_time, task_id) for start_time, task_id in self.running_heap
+            if tasks[task_id].state == TaskState.RUNNING and tasks[task_id].start_time == start_time
+        ]
+        heapq.heapify(self.running_heap)
+        self.stale_running = 0
+
+    def _register(self, task: Task):
+        self.tasks[task.task_id] = task
+        self.state_counts[task.state] += 1
+        self.pending_queue.append(task.task_id)
+        self._update_done()
+
+    def _update_done(self):
+        if self.state_counts[TaskState.PENDING] or self.state_counts[TaskState.RUNNING]:
+            self._done.clear()
+        else:
+            self._done.set()
+
     def add_task(self, task: Task):
         with self.lock:
-            self.tasks[task.task_id] = task
-            self.pending_queue.append(task.task_id)
+            self._register(task)
 
     def get_next_task(self, worker_id: str) -> Optional[Task]:
-        with self.lock:
-            if not self.pending_queue:
-                return None
+        try:
+            task_id = self.pending_queue.popleft()
+        except IndexError:
+            return None
 
-            task_id = self.pending_queue.pop(0)
+        with self.lock:
             task = self.tasks[task_id]
-            task.state = TaskState.RUNNING
+            self._set_state(task, TaskState.RUNNING)
             task.worker_id = worker_id
             task.start_time = time.time()
             task.attempts += 1
+            heapq.heappush(self.running_heap, (task.start_time, task_id))
 
             return task
 
@@ -61,9 +103,12 @@ class JobScheduler:
                 return
 
             task = self.tasks[task_id]
-            task.state = TaskState.COMPLETED
+            self._set_state(task, TaskState.COMPLETED)
             task.end_time = time.time()
             task.result = result
+            if task.start_time:
+                self.completed_sum += task.end_time - task.start_time
+                self.completed_count += 1
 
     def fail_task(self, task_id: str, error: str):
         with self.lock:
@@ -73,12 +118,12 @@ class JobScheduler:
             task = self.tasks[task_id]
 
             if task.attempts < self.max_retries:
-                task.state = TaskState.PENDING
+                self._set_state(task, TaskState.PENDING)
                 task.worker_id = None
                 task.error = error
                 self.pending_queue.append(task_id)
             else:
-                task.state = TaskState.FAILED
+                self._set_state(task, TaskState.FAILED)
                 task.end_time = time.time()
                 task.error = error
 
@@ -89,20 +134,17 @@ class JobScheduler:
                 if task.state == TaskState.RUNNING:
                     if task.start_time and now - task.start_time > self.task_timeout:
                         if task.attempts < self.max_retries:
-                            task.state = TaskState.PENDING
+                            self._set_state(task, TaskState.PENDING)
                             task.worker_id = None
                             task.error = 'timeout'
                             self.pending_queue.append(task_id)
                         else:
-                            task.state = TaskState.FAILED
+                            self._set_state(task, TaskState.FAILED)
                             task.error = 'timeout after max retries'
 
     def get_status(self) -> dict:
         with self.lock:
-            counts = {s: 0 for s in TaskState}
-            for task in self.tasks.values():
-                counts[task.state] += 1
-
+            counts = dict(self.state_counts)
             return {
                 'total': len(self.tasks),
                 'pending': counts[TaskState.PENDING],
@@ -113,21 +155,23 @@ class JobScheduler:
 
     def all_complete(self) -> bool:
         with self.lock:
-            for task in self.tasks.values():
-                if task.state not in (TaskState.COMPLETED, TaskState.FAILED):
-                    return False
-            return True
+            return self.state_counts[TaskState.PENDING] == 0 and self.state_counts[TaskState.RUNNING] == 0
+
+    def wait_complete(self, timeout: float = None) -> bool:
+        return self._done.wait(timeout)
 
     def any_failed(self) -> bool:
         with self.lock:
-            return any(t.state == TaskState.FAILED for t in self.tasks.values())
+            return self.state_counts[TaskState.FAILED] > 0
 
 class Worker:
-    def __init__(self, worker_id: str, scheduler: JobScheduler, map_func: Callable = None, reduce_func: Callable = None):
+    def __init__(self, worker_id: str, scheduler: JobScheduler, map_func: Callable = None, reduce_func: Callable = None, mapper_cls: type = None, num_partitions: int = 4):
         self.worker_id = worker_id
         self.scheduler = scheduler
         self.map_func = map_func
         self.reduce_func = reduce_func
+        self.mapper_cls = mapper_cls
+        self.num_partitions = num_partitions
         self.running = False
         self.thread = None
 
@@ -154,7 +198,7 @@ class Worker:
 
             try:
                 if task.task_type == 'map':
-                    mapper = Mapper(self.map_func, output_dir=task.output_dir)
+                    mapper = (self.mapper_cls or Mapper)(self.map_func, num_partitions=self.num_partitions, output_dir=task.output_dir, packed=True)
                     result = mapper.process_file(task.input_files[0], task.task_id)
                     self.scheduler.complete_task(task.task_id, result)
 
@@ -168,10 +212,10 @@ class Worker:
                 self.scheduler.fail_task(task.task_id, str(e))
 
 class WorkerPool:
-    def __init__(self, num_workers: int, scheduler: JobScheduler, map_func: Callable = None, reduce_func: Callable = None):
+    def __init__(self, num_workers: int, scheduler: JobScheduler, map_func: Callable = None, reduce_func: Callable = None, mapper_cls: type = None, num_partitions: int = 4):
         self.workers = []
         for i in range(num_workers):
-            worker = Worker(f'worker_{i}', scheduler, map_func, reduce_func)
+            worker = Worker(f'worker_{i}', scheduler, map_func, reduce_func, mapper_cls, num_partitions)
             self.workers.append(worker)
 
     def start(self):
@@ -190,25 +234,35 @@ class SpeculativeExecution:
         self.speculative_tasks: Dict[str, str] = {}
 
     def check_for_slow_tasks(self):
-        with self.scheduler.lock:
-            completed_times = []
-            for task in self.scheduler.tasks.values():
-                if task.state == TaskState.COMPLETED and task.start_time and task.end_time:
-                    completed_times.append(task.end_time - task.start_time)
-
-            if not completed_times:
+        scheduler = self.scheduler
+        with scheduler.lock:
+            if not scheduler.completed_count:
                 return []
 
-            avg_time = sum(completed_times) / len(completed_times)
-            slow_tasks = []
+            avg_time = scheduler.completed_sum / scheduler.completed_count
+            cutoff = time.time() - avg_time * self.slow_threshold
+            tasks = scheduler.tasks
+            heap = scheduler.running_heap
 
-            now = time.time()
-            for task_id, task in self.scheduler.tasks.items():
-                if task.state == TaskState.RUNNING and task.start_time:
-                    running_time = now - task.start_time
-                    if running_time > avg_time * self.slow_threshold:
-                        if task_id not in self.speculative_tasks:
-                            slow_tasks.append(task_id)
+            while heap:
+                start_time, task_id = heap[0]
+                task = tasks[task_id]
+                if task.state == TaskState.RUNNING and task.start_time == start_time:
+                    break
+                heapq.heappop(heap)
+                scheduler.stale_running -= 1
+
+            slow_tasks = []
+            stack = [0]
+            while stack:
+                i = stack.pop()
+                if i >= len(heap) or heap[i][0] >= cutoff:
+                    continue
+                start_time, task_id = heap[i]
+                task = tasks[task_id]
+                if task.state == TaskState.RUNNING and task.start_time == start_time and task_id not in self.speculative_tasks:
+                    slow_tasks.append(task_id)
+                stack += (2 * i + 1, 2 * i + 2)
 
             return slow_tasks
 
@@ -227,8 +281,7 @@ class SpeculativeExecution:
                 output_dir=original.output_dir
             )
 
-            self.scheduler.tasks[spec_id] = spec_task
-            self.scheduler.pending_queue.append(spec_id)
+            self.scheduler._register(spec_task)
             self.speculative_tasks[original_task_id] = spec_id
 
             return spec_id
@@ -0,0 +1,148 @@
+import io
+import mmap
+import os
+import struct
+import threading
+from pathlib import Path
+from typing import Iterator
+from codec import IO_BUF
+
+EXTENT = struct.Struct('<IQQ')
+SHUFFLE_BUF = 64 * 1024
+PACKED_REGION = 4 * 1024 * 1024
+PACKED_ALIGN = 64
+
+class PartitionFiles:
+    def __init__(self, output_dir: Path, task_id: str, num_partitions: int):
+        self.paths = [str(output_dir / f'{task_id}_partition_{i}.json') for i in range(num_partitions)]
+        self.handles = [open(path, 'wb', buffering=IO_BUF) for path in self.paths]
+
+    def write(self, partition: int, data: bytes):
+        self.handles[partition].write(data)
+
+    def close(self):
+        for handle in self.handles:
+            handle.close()
+
+    def refs(self) -> list:
+        return list(self.paths)
+
+class ShuffleService:
+    def __init__(self, output_dir: Path, num_partitions: int):
+        self.paths = [str(output_dir / f'shuffle_partition_{i}.json') for i in range(num_partitions)]
+        self.handles = [open(path, 'wb', buffering=SHUFFLE_BUF) for path in self.paths]
+        self.locks = [threading.Lock() for _ in range(num_partitions)]
+
+    def write(self, partition: int, data: bytes):
+        with self.locks[partition]:
+            self.handles[partition].write(data)
+
+    def close(self):
+        for handle in self.handles:
+            handle.close()
+
+    def refs(self) -> list:
+        return list(self.paths)
+
+class SegmentFile:
+    def __init__(self, output_dir: Path, task_id: str, num_partitions: int):
+        self.path = str(output_dir / f'{task_id}.bin')
+        self.num_partitions = num_partitions
+        self.handle = open(self.path, 'wb', buffering=IO_BUF)
+        self.extents = bytearray()
+        self.offset = 0
+
+    def write(self, partition: int, data: bytes):
+        self.handle.write(data)
+        self.extents += EXTENT.pack(partition, self.offset, len(data))
+        self.offset += len(data)
+
+    def close(self):
+        self.handle.close()
+        self._write_index()
+
+    def _write_index(self):
+        with open(index_path(self.path), 'wb') as f:
+            f.write(self.extents)
+
+    def extent_count(self) -> int:
+        return len(self.extents) // EXTENT.size
+
+    def refs(self, first_extent: int = None) -> list:
+        if first_extent is None:
+            return [f'{self.path}#{i}' for i in range(self.num_partitions)]
+        return [f'{self.path}#{i}@{first_extent}:{self.extent_count()}' for i in range(self.num_partitions)]
+
+class PackedFile(SegmentFile):
+    def __init__(self, output_dir: Path, task_id: str, num_partitions: int):
+        self.path = str(output_dir / f'{task_id}.bin')
+        self.num_partitions = num_partitions
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        self.size = PACKED_REGION
+        os.ftruncate(self.fd, self.size)
+        self.mm = mmap.mmap(self.fd, self.size)
+        self.extents = bytearray()
+        self.offset = 0
+        self.end = 0
+
+    def write(self, partition: int, data: bytes):
+        end = self.offset + len(data)
+        if end > self.size:
+            self._grow(end)
+        self.mm[self.offset:end] = data
+        self.extents += EXTENT.pack(partition, self.offset, len(data))
+        self.end = end
+        self.offset = (end + PACKED_ALIGN - 1) & -PACKED_ALIGN
+
+    def _grow(self, end: int):
+        self.mm.close()
+        self.size = -(-end // PACKED_REGION) * PACKED_REGION
+        os.ftruncate(self.fd, self.size)
+        self.mm = mmap.mmap(self.fd, self.size)
+
+    def close(self):
+        self.mm.close()
+        os.ftruncate(self.fd, self.end)
+        os.close(self.fd)
+        self._write_index()
+
+def index_path(path: str) -> str:
+    return path[:-len('.bin')] + '.idx'
+
+def split_ref(ref: str) -> tuple:
+    path, sep, selector = ref.rpartition('#')
+    if sep and path.endswith('.bin'):
+        partition, _, extents = selector.partition('@')
+        if partition.isdigit():
+            first, _, last = extents.partition(':')
+            return path, int(partition), int(first or 0), int(last) if last else None
+    return ref, None, 0, None
+
+def exists(ref: str) -> bool:
+    return os.path.exists(split_ref(ref)[0])
+
+def read_lines(ref: str) -> list:
+    path, partition, _, _ = split_ref(ref)
+    if partition is None:
+        with open(path, 'rb') as f:
+            return f.read().splitlines()
+    return list(iter_lines(ref))
+
+def iter_lines(ref: str) -> Iterator[bytes]:
+    path, partition, first, last = split_ref(ref)
+    if partition is None:
+        with open(path, 'rb', buffering=IO_BUF) as f:
+            yield from f
+        return
+
+    with open(index_path(path), 'rb') as f:
+        index = f.read()
+    index = index[first * EXTENT.size:None if last is None else last * EXTENT.size]
+    extents = [(offset, length) for p, offset, length in EXTENT.iter_unpack(index) if p == partition]
+    if not extents:
+        return
+
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for offset, length in extents:
+                yield from io.BytesIO(mm[offset:offset + length])
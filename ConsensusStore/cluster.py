@@ -1,10 +1,13 @@
 import socket
-import json
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from protocol import recv_message, send_message
 from raft_node import RaftNode
 from state_machine import KeyValueStateMachine
 
+NOT_LEADER_TTL = 0.2
+
 class ConsensusCluster:
     def __init__(self, node_configs):
         self.nodes = {}
@@ -25,16 +28,20 @@ class ConsensusCluster:
             )
 
             sm = KeyValueStateMachine()
-            node.apply_callback = lambda entry, sm=sm: sm.apply(entry)
+            node.apply_callback = sm.apply
+            node.batch_apply_callback = sm.apply_batch
 
             self.nodes[node_id] = node
             self.state_machines[node_id] = sm
 
+        self._client = ConsensusClient([(node.host, node.port) for node in self.nodes.values()], timeout=1.0)
+
     def start(self):
         for node in self.nodes.values():
             node.start()
 
     def stop(self):
+        self._client.close()
         for node in self.nodes.values():
             node.stop()
 
@@ -46,48 +53,102 @@ class ConsensusCluster:
         return None
 
     def _get_status(self, node):
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(1.0)
-            sock.connect((node.host, node.port))
-            sock.sendall(json.dumps({'cmd': 'status'}).encode())
-            response = json.loads(sock.recv(65536).decode())
-            sock.close()
-            return response
-        except:
-            return None
+        response = self._client._send((node.host, node.port), {'cmd': 'status'})
+        return response if response.get('ok') else None
 
 class ConsensusClient:
-    def __init__(self, nodes):
+    def __init__(self, nodes, timeout=5.0):
         self.nodes = nodes
         self.leader_addr = None
+        self.timeout = timeout
+        self._sockets = {}
+        self._locks = {}
+        self._not_leader = {}
+        self._pool = ThreadPoolExecutor(max_workers=max(1, len(nodes)))
+
+    def _connect(self, addr):
+        sock = socket.create_connection(addr, timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sockets[addr] = sock
+        return sock
+
+    def _discard(self, addr, sock):
+        self._sockets.pop(addr, None)
+        sock.close()
 
     def _send(self, addr, request):
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(5.0)
-            sock.connect(addr)
-            sock.sendall(json.dumps(request).encode())
-            response = json.loads(sock.recv(65536).decode())
-            sock.close()
-            return response
-        except Exception as e:
-            return {'ok': False, 'error': str(e)}
-
-    def _find_leader(self):
-        for addr in self.nodes:
-            response = self._send(addr, {'cmd': 'status'})
-            if response.get('ok') and response.get('state') == 'LEADER':
-                self.leader_addr = addr
-                return addr
-        return None
+        lock = self._locks.get(addr)
+        if lock is None:
+            lock = self._locks.setdefault(addr, threading.Lock())
+
+        with lock:
+            sock = self._sockets.get(addr)
+            if sock is not None:
+                try:
+                    send_message(sock, request)
+                    return recv_message(sock)
+                except (ConnectionError, BrokenPipeError):
+                    self._discard(addr, sock)
+                except Exception as e:
+                    self._discard(addr, sock)
+                    return {'ok': False, 'error': str(e)}
+
+            sock = None
+            try:
+                sock = self._connect(addr)
+                send_message(sock, request)
+                return recv_message(sock)
+            except Exception as e:
+                if sock is not None:
+                    self._discard(addr, sock)
+                return {'ok': False, 'error': str(e)}
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+        for addr, sock in list(self._sockets.items()):
+            self._discard(addr, sock)
+
+    def _probe(self, addr):
+        response = self._send(addr, {'cmd': 'status'})
+        if response.get('ok') and response.get('state') == 'LEADER':
+            self._not_leader.pop(addr, None)
+            self.leader_addr = addr
+            return addr, None
+        self._not_leader[addr] = time.monotonic() + NOT_LEADER_TTL
+        return None, _hint(response)
+
+    def _find_leader(self, hint=None):
+        probed = set()
+        while True:
+            if hint:
+                probed.add(hint)
+                leader, hint = self._probe(hint)
+                if leader:
+                    return leader
+
+            now = time.monotonic()
+            candidates = [addr for addr in self.nodes if addr not in probed and self._not_leader.get(addr, 0) <= now]
+            probed.update(candidates)
+            hints = set()
+            for future in as_completed([self._pool.submit(self._probe, addr) for addr in candidates]):
+                leader, reported = future.result()
+                if leader:
+                    return leader
+                if reported:
+                    hints.add(reported)
+
+            hints -= probed
+            if not hints:
+                return None
+            hint = hints.pop()
 
     def _get_leader(self):
         if self.leader_addr:
-            response = self._send(self.leader_addr, {'cmd': 'status'})
-            if response.get('ok') and response.get('state') == 'LEADER':
-                return self.leader_addr
+            leader, hint = self._probe(self.leader_addr)
+            if leader:
+                return leader
             self.leader_addr = None
+            return self._find_leader(hint)
         return self._find_leader()
 
     def set(self, key, value):
@@ -101,7 +162,7 @@ class ConsensusClient:
         })
 
         if response.get('error') == 'not leader':
-            self.leader_addr = None
+            self.leader_addr = _hint(response)
             return self.set(key, value)
 
         return response
@@ -137,11 +198,12 @@ class ConsensusClient:
         })
 
     def status(self):
-        results = {}
-        for addr in self.nodes:
-            response = self._send(addr, {'cmd': 'status'})
-            results[f'{addr[0]}:{addr[1]}'] = response
-        return results
+        futures = {addr: self._pool.submit(self._send, addr, {'cmd': 'status'}) for addr in self.nodes}
+        return {f'{addr[0]}:{addr[1]}': future.result() for addr, future in futures.items()}
+
+def _hint(response):
+    hint = response.get('leader_hint')
+    return tuple(hint) if hint else None
 
 if __name__ == '__main__':
     configs = {
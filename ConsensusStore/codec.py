@@ -0,0 +1,10 @@
+try:
+    from orjson import dumps, loads
+except ImportError:
+    import json
+
+    _encode = json.JSONEncoder(separators=(',', ':')).encode
+    loads = json.loads
+
+    def dumps(obj):
+        return _encode(obj).encode()
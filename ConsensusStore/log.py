@@ -1,99 +1,254 @@
+import os
+import mmap
 import struct
-import json
 import threading
 from pathlib import Path
 from dataclasses import dataclass
 from typing import Any, List, Optional
+from codec import dumps, loads
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class PersistentLogEntry:
     term: int
     index: int
     command: Any
 
+RECORD_HEADER = struct.Struct('>Q Q I')
+METADATA = struct.Struct('>Q q')
+
+ENCODE_BUF_SIZE = 4096
+ENCODE_BUF_SOFT_MAX = 128 * 1024
+
 class PersistentLog:
-    def __init__(self, path):
+    def __init__(self, path, segment_size=64 * 1024 * 1024):
         self.path = Path(path)
-        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._prepare_dir()
+        self.segment_size = segment_size
         self.entries = []
+        self.positions = []
+        self.segments = []
+        self.base_index = 0
+        self.base_term = 0
         self.lock = threading.Lock()
+        self._active_size = 0
         self._load()
+        if self.entries:
+            self.base_index = self.entries[0].index - 1
+
+        if not self.segments:
+            self.segments.append(1)
+        self.fd = self._open_segment(self.segments[-1])
+        self._pending = []
+        self._enqueued = 0
+        self._durable = 0
+        self._closed = False
+        self._flush_lock = threading.Lock()
+        self._flush_cv = threading.Condition()
+        self._encode_buf = bytearray(ENCODE_BUF_SIZE)
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+
+    def _prepare_dir(self):
+        staged = self.path.with_name(self.path.name + '.migrating')
+        if self.path.is_file():
+            os.replace(self.path, staged)
+        self.path.mkdir(parents=True, exist_ok=True)
+        if staged.exists():
+            os.replace(staged, self._segment_path(1))
+
+    def _segment_path(self, seg_id):
+        return self.path / f'seg-{seg_id:08d}.log'
+
+    def _open_segment(self, seg_id):
+        return os.open(self._segment_path(seg_id), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
 
     def _load(self):
-        if not self.path.exists():
-            return
-
-        with open(self.path, 'rb') as f:
-            while True:
-                header = f.read(16)
-                if len(header) < 16:
-                    break
-
-                term, index, cmd_len = struct.unpack('>Q Q', header[:16])
-
-                header_rest = f.read(4)
-                if len(header_rest) < 4:
-                    break
-                cmd_len = struct.unpack('>I', header_rest)[0]
-
-                cmd_data = f.read(cmd_len)
-                if len(cmd_data) < cmd_len:
-                    break
-
-                command = json.loads(cmd_data.decode())
-                self.entries.append(PersistentLogEntry(term, index, command))
-
-    def _append_to_file(self, entry):
-        cmd_bytes = json.dumps(entry.command).encode()
-        header = struct.pack('>Q Q I', entry.term, entry.index, len(cmd_bytes))
-
-        with open(self.path, 'ab') as f:
-            f.write(header)
-            f.write(cmd_bytes)
+        seg_ids = sorted(int(p.stem[4:]) for p in self.path.glob('seg-*.log'))
+        for seg_id in seg_ids:
+            self.segments.append(seg_id)
+            self._active_size = self._load_segment(seg_id)
+
+    def _load_segment(self, seg_id):
+        seg_path = self._segment_path(seg_id)
+        with open(seg_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return 0
+            with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+                header_size = RECORD_HEADER.size
+                unpack_from = RECORD_HEADER.unpack_from
+                headers = []
+                spans = []
+                offset = 0
+                while offset + header_size <= size:
+                    term, index, cmd_len = unpack_from(mm, offset)
+                    start = offset + header_size
+                    if start + cmd_len > size:
+                        break
+
+                    headers.append((term, index, offset))
+                    spans.append(mm[start:start + cmd_len])
+                    offset = start + cmd_len
+
+                if spans:
+                    commands = loads(b'[' + b','.join(spans) + b']')
+                    for (term, index, record_offset), command in zip(headers, commands):
+                        self.entries.append(PersistentLogEntry(term, index, command))
+                        self.positions.append((seg_id, record_offset))
+
+        if offset < size:
+            os.truncate(seg_path, offset)
+        return offset
+
+    def _append_to_file(self, entry, cmd_bytes):
+        with self._flush_cv:
+            self._pending.append((entry.term, entry.index, cmd_bytes))
+            self._enqueued += 1
+            self._flush_cv.notify_all()
+            return self._enqueued
+
+    def _wait_durable(self, ticket):
+        with self._flush_cv:
+            while self._durable < ticket and not self._closed:
+                self._flush_cv.wait()
+
+    def _flush_loop(self):
+        while True:
+            with self._flush_cv:
+                while not self._pending and not self._closed:
+                    self._flush_cv.wait()
+                if self._closed:
+                    return
+            self._flush()
+
+    def _flush(self):
+        with self._flush_lock:
+            with self._flush_cv:
+                batch = self._pending
+                self._pending = []
+                upto = self._enqueued
+
+            if batch:
+                self._write_records(batch)
+                os.fsync(self.fd)
+
+            with self._flush_cv:
+                self._durable = upto
+                self._flush_cv.notify_all()
+
+    def _write_records(self, records):
+        header_size = RECORD_HEADER.size
+        need = sum(header_size + len(cmd_bytes) for _, _, cmd_bytes in records)
+        if len(self._encode_buf) < need:
+            self._encode_buf = bytearray(need)
+        buf = self._encode_buf
+
+        offset = 0
+        for term, index, cmd_bytes in records:
+            RECORD_HEADER.pack_into(buf, offset, term, index, len(cmd_bytes))
+            offset += header_size
+            buf[offset:offset + len(cmd_bytes)] = cmd_bytes
+            offset += len(cmd_bytes)
+
+        view = memoryview(buf)[:need]
+        while view:
+            view = view[os.write(self.fd, view):]
+        del view
+
+        if len(buf) > ENCODE_BUF_SOFT_MAX:
+            self._encode_buf = bytearray(ENCODE_BUF_SOFT_MAX)
+
+    def _roll_segment(self):
+        self._flush()
+        with self._flush_lock:
+            os.close(self.fd)
+            seg_id = self.segments[-1] + 1
+            self.segments.append(seg_id)
+            self.fd = self._open_segment(seg_id)
+            self._active_size = 0
 
     def append(self, term, command):
         with self.lock:
-            index = len(self.entries) + 1
+            index = self.base_index + len(self.entries) + 1
             entry = PersistentLogEntry(term, index, command)
+            cmd_bytes = dumps(command)
+            record_size = RECORD_HEADER.size + len(cmd_bytes)
+            if self._active_size and self._active_size + record_size > self.segment_size:
+                self._roll_segment()
+
             self.entries.append(entry)
-            self._append_to_file(entry)
-            return entry
+            self.positions.append((self.segments[-1], self._active_size))
+            self._active_size += record_size
+            ticket = self._append_to_file(entry, cmd_bytes)
+        self._wait_durable(ticket)
+        return entry
+
+    def close(self):
+        self._flush()
+        with self._flush_cv:
+            self._closed = True
+            self._flush_cv.notify_all()
+        self._flusher.join()
+        os.close(self.fd)
 
     def get(self, index):
         with self.lock:
-            if 1 <= index <= len(self.entries):
-                return self.entries[index - 1]
+            offset = index - self.base_index
+            if 1 <= offset <= len(self.entries):
+                return self.entries[offset - 1]
             return None
 
     def get_range(self, start_index, end_index=None):
         with self.lock:
             if end_index is None:
-                end_index = len(self.entries)
-            return self.entries[start_index - 1:end_index]
+                end_index = self.base_index + len(self.entries)
+            start = max(start_index - self.base_index, 1)
+            return self.entries[start - 1:end_index - self.base_index]
 
     def last_index(self):
         with self.lock:
-            return len(self.entries)
+            return self.base_index + len(self.entries)
 
     def last_term(self):
         with self.lock:
             if self.entries:
                 return self.entries[-1].term
-            return 0
+            return self.base_term
+
+    def truncate_prefix(self, upto_index):
+        with self.lock:
+            count = min(upto_index - self.base_index, len(self.entries))
+            if count <= 0:
+                return
+
+            keep_seg, _ = self.positions[count - 1]
+            while self.segments[0] < keep_seg:
+                os.unlink(self._segment_path(self.segments.pop(0)))
+
+            self.base_term = self.entries[count - 1].term
+            self.base_index += count
+            del self.entries[:count]
+            del self.positions[:count]
 
     def truncate_from(self, index):
         with self.lock:
-            if index <= len(self.entries):
-                self.entries = self.entries[:index - 1]
-                self._rewrite()
-
-    def _rewrite(self):
-        with open(self.path, 'wb') as f:
-            for entry in self.entries:
-                cmd_bytes = json.dumps(entry.command).encode()
-                header = struct.pack('>Q Q I', entry.term, entry.index, len(cmd_bytes))
-                f.write(header)
-                f.write(cmd_bytes)
+            index = max(index - self.base_index, 1)
+            if index > len(self.entries):
+                return
+            seg_id, offset = self.positions[index - 1]
+
+            self._flush()
+            with self._flush_lock:
+                os.close(self.fd)
+                while self.segments[-1] > seg_id:
+                    os.unlink(self._segment_path(self.segments.pop()))
+                os.truncate(self._segment_path(seg_id), offset)
+                self.fd = self._open_segment(seg_id)
+                os.fsync(self.fd)
+                self._active_size = offset
+
+            del self.entries[index - 1:]
+            del self.positions[index - 1:]
 
 class RaftMetadata:
     def __init__(self, path):
@@ -102,23 +257,23 @@ class RaftMetadata:
         self.current_term = 0
         self.voted_for = None
         self.lock = threading.Lock()
+        self._md_fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
         self._load()
 
     def _load(self):
-        if not self.path.exists():
-            return
-
-        with open(self.path, 'rb') as f:
-            data = f.read()
-            if len(data) >= 16:
-                term, voted_for = struct.unpack('>Q q', data[:16])
-                self.current_term = term
-                self.voted_for = voted_for if voted_for >= 0 else None
+        data = os.pread(self._md_fd, METADATA.size, 0)
+        if len(data) == METADATA.size:
+            term, voted_for = METADATA.unpack(data)
+            self.current_term = term
+            self.voted_for = voted_for if voted_for >= 0 else None
 
     def _save(self):
         voted = self.voted_for if self.voted_for is not None else -1
-        with open(self.path, 'wb') as f:
-            f.write(struct.pack('>Q q', self.current_term, voted))
+        os.pwrite(self._md_fd, METADATA.pack(self.current_term, voted), 0)
+        os.fsync(self._md_fd)
+
+    def close(self):
+        os.close(self._md_fd)
 
     def get_term(self):
         with self.lock:
@@ -170,11 +325,18 @@ class LogCompactor:
             'state': state_machine_state
         }
 
-        with open(self.snapshot_path, 'w') as f:
-            json.dump(snapshot, f)
+        tmp_path = self.snapshot_path.with_name(self.snapshot_path.name + '.tmp')
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.write(fd, dumps(snapshot))
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmp_path, self.snapshot_path)
 
         self.last_included_index = last_applied
         self.last_included_term = entry.term
+        self.log.truncate_prefix(last_applied)
 
         return True
 
@@ -182,8 +344,8 @@ class LogCompactor:
         if not self.snapshot_path.exists():
             return None
 
-        with open(self.snapshot_path) as f:
-            snapshot = json.load(f)
+        with open(self.snapshot_path, 'rb') as f:
+            snapshot = loads(f.read())
 
         self.last_included_index = snapshot['last_included_index']
         self.last_included_term = snapshot['last_included_term']
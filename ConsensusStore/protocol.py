@@ -0,0 +1,36 @@
+import struct
+from codec import dumps, loads
+
+HEADER = struct.Struct('>I')
+
+def _recv_exact(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError('connection closed')
+        buf += chunk
+    return bytes(buf)
+
+def send_frame(sock, payload):
+    sock.sendall(HEADER.pack(len(payload)) + payload)
+
+def send_message(sock, message):
+    send_frame(sock, dumps(message))
+
+def recv_message(sock):
+    length, = HEADER.unpack(_recv_exact(sock, HEADER.size))
+    return loads(_recv_exact(sock, length))
+
+def drain_messages(buf):
+    messages = []
+    start = 0
+    while len(buf) - start >= HEADER.size:
+        length, = HEADER.unpack_from(buf, start)
+        end = start + HEADER.size + length
+        if end > len(buf):
+            break
+        messages.append(loads(buf[start + HEADER.size:end]))
+        start = end
+    del buf[:start]
+    return messages
@@ -1,28 +1,92 @@
+import selectors
 import socket
-import json
 import threading
 import time
 import random
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 from enum import IntEnum
 from dataclasses import dataclass, field
 from typing import List, Dict, Optional, Any
+from codec import dumps
+from protocol import drain_messages, recv_message, send_frame, send_message
 
 class State(IntEnum):
     FOLLOWER = 0
     CANDIDATE = 1
     LEADER = 2
 
-@dataclass
+@dataclass(slots=True)
 class LogEntry:
     term: int
     index: int
     command: Any
+    _encoded: Optional[bytes] = field(default=None, repr=False, compare=False)
+
+    def encoded(self):
+        if self._encoded is None:
+            self._encoded = dumps({'term': self.term, 'index': self.index, 'command': self.command})
+        return self._encoded
+
+class SegmentedLog:
+    def __init__(self, entries=None, offset=0, offset_term=0):
+        self.entries: List[LogEntry] = list(entries) if entries else []
+        self.offset = offset
+        self.offset_term = offset_term
+        self._shift = offset
+
+    def __len__(self):
+        return self._shift + len(self.entries) - self.offset
+
+    def __getitem__(self, index):
+        if index <= self.offset:
+            raise IndexError(index)
+        return self.entries[index - self._shift - 1]
+
+    def __setitem__(self, index, entry):
+        if index <= self.offset:
+            raise IndexError(index)
+        self.entries[index - self._shift - 1] = entry
+
+    @property
+    def last_index(self):
+        return self._shift + len(self.entries)
+
+    @property
+    def last_term(self):
+        if self.last_index > self.offset:
+            return self.entries[-1].term
+        return self.offset_term
+
+    def term_at(self, index):
+        if index == self.offset:
+            return self.offset_term
+        return self[index].term
+
+    def append(self, entry):
+        self.entries.append(entry)
+
+    def slice(self, start, stop):
+        start = max(start, self.offset + 1)
+        return self.entries[start - self._shift - 1:stop - self._shift - 1]
+
+    def truncate_from(self, index):
+        del self.entries[max(index, self.offset + 1) - self._shift - 1:]
+
+    def compact(self, upto):
+        if upto <= self.offset or upto > self.last_index:
+            return
+        self.offset_term = self[upto].term
+        self.offset = upto
+        dead = self.offset - self._shift
+        if dead > len(self.entries) // 2:
+            del self.entries[:dead]
+            self._shift = self.offset
 
 @dataclass
 class RaftState:
     current_term: int = 0
     voted_for: Optional[int] = None
-    log: List[LogEntry] = field(default_factory=list)
+    log: SegmentedLog = field(default_factory=SegmentedLog)
     commit_index: int = 0
     last_applied: int = 0
 
@@ -39,13 +103,21 @@ class RaftNode:
         self.match_index = {}
 
         self.lock = threading.Lock()
+        self._apply_lock = threading.Lock()
         self.running = False
         self.leader_id = None
         self.election_timeout = self._random_timeout()
         self.last_heartbeat = time.time()
 
         self.apply_callback = None
+        self.batch_apply_callback = None
         self.server_socket = None
+        self._rpc_pool = ThreadPoolExecutor(max_workers=max(1, len(peers)))
+        self._request_pool = ThreadPoolExecutor(max_workers=max(4, 2 * len(peers)))
+        self._peer_sockets: Dict[tuple, socket.socket] = {}
+        self._peer_locks: Dict[tuple, threading.Lock] = {addr: threading.Lock() for addr in peers.values()}
+        self._payload_epoch = None
+        self._payload_cache: Dict[int, bytes] = {}
 
     def _random_timeout(self):
         return random.uniform(1.5, 3.0)
@@ -71,23 +143,47 @@ class RaftNode:
             self.server_socket.close()
 
     def _serve(self):
-        while self.running:
-            try:
-                conn, addr = self.server_socket.accept()
-                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
-            except:
-                break
-
-    def _handle(self, conn):
+        sel = selectors.DefaultSelector()
+        sel.register(self.server_socket, selectors.EVENT_READ)
         try:
-            data = conn.recv(65536)
-            if not data:
-                return
-            request = json.loads(data.decode())
-            response = self._process(request)
-            conn.sendall(json.dumps(response).encode())
+            while self.running:
+                for key, _ in sel.select(timeout=0.5):
+                    if key.data is None:
+                        self._on_accept(sel)
+                    else:
+                        self._on_readable(sel, key.fileobj, key.data)
         finally:
+            for key in list(sel.get_map().values()):
+                if key.data is not None:
+                    key.fileobj.close()
+            sel.close()
+
+    def _on_accept(self, sel):
+        try:
+            conn, addr = self.server_socket.accept()
+        except OSError:
+            self.running = False
+            return
+        sel.register(conn, selectors.EVENT_READ, bytearray())
+
+    def _on_readable(self, sel, conn, buf):
+        try:
+            chunk = conn.recv(65536)
+        except OSError:
+            chunk = b''
+        if not chunk:
+            sel.unregister(conn)
             conn.close()
+            return
+        buf += chunk
+        for request in drain_messages(buf):
+            self._request_pool.submit(self._respond, conn, request)
+
+    def _respond(self, conn, request):
+        try:
+            send_message(conn, self._process(request))
+        except OSError:
+            pass
 
     def _process(self, request):
         cmd = request.get('cmd')
@@ -119,9 +215,9 @@ class RaftNode:
                 return {'term': self.raft_state.current_term, 'vote_granted': False}
 
             log_ok = True
-            if self.raft_state.log:
-                my_last_term = self.raft_state.log[-1].term
-                my_last_index = self.raft_state.log[-1].index
+            if self.raft_state.log.last_index:
+                my_last_term = self.raft_state.log.last_term
+                my_last_index = self.raft_state.log.last_index
                 if last_log_term < my_last_term:
                     log_ok = False
                 elif last_log_term == my_last_term and last_log_index < my_last_index:
@@ -136,60 +232,73 @@ class RaftNode:
 
     def _handle_append_entries(self, request):
         with self.lock:
-            term = request['term']
-            leader_id = request['leader_id']
-            prev_log_index = request['prev_log_index']
-            prev_log_term = request['prev_log_term']
-            entries = request['entries']
-            leader_commit = request['leader_commit']
+            response = self._accept_append_entries(request)
+        self._apply_committed()
+        return response
+
+    def _accept_append_entries(self, request):
+        term = request['term']
+        leader_id = request['leader_id']
+        prev_log_index = request['prev_log_index']
+        prev_log_term = request['prev_log_term']
+        entries = request['entries']
+        leader_commit = request['leader_commit']
+
+        if term > self.raft_state.current_term:
+            self.raft_state.current_term = term
+            self.raft_state.voted_for = None
+            self.state = State.FOLLOWER
 
-            if term > self.raft_state.current_term:
-                self.raft_state.current_term = term
-                self.raft_state.voted_for = None
-                self.state = State.FOLLOWER
+        if term < self.raft_state.current_term:
+            return {'term': self.raft_state.current_term, 'success': False}
 
-            if term < self.raft_state.current_term:
-                return {'term': self.raft_state.current_term, 'success': False}
+        self._reset_election_timer()
+        self.leader_id = leader_id
+        self.state = State.FOLLOWER
 
-            self._reset_election_timer()
-            self.leader_id = leader_id
-            self.state = State.FOLLOWER
+        log = self.raft_state.log
+        if prev_log_index > log.offset:
+            if prev_log_index > log.last_index:
+                return {'term': self.raft_state.current_term, 'success': False}
+            if log[prev_log_index].term != prev_log_term:
+                log.truncate_from(prev_log_index)
+                return {'term': self.raft_state.current_term, 'success': False}
 
-            if prev_log_index > 0:
-                if prev_log_index > len(self.raft_state.log):
-                    return {'term': self.raft_state.current_term, 'success': False}
-                if self.raft_state.log[prev_log_index - 1].term != prev_log_term:
-                    self.raft_state.log = self.raft_state.log[:prev_log_index - 1]
-                    return {'term': self.raft_state.current_term, 'success': False}
-
-            for entry_data in entries:
-                entry = LogEntry(entry_data['term'], entry_data['index'], entry_data['command'])
-                if entry.index <= len(self.raft_state.log):
-                    self.raft_state.log[entry.index - 1] = entry
-                else:
-                    self.raft_state.log.append(entry)
+        for entry_data in entries:
+            index = entry_data['index']
+            if index <= log.offset:
+                continue
+            entry = LogEntry(entry_data['term'], index, entry_data['command'])
+            if index <= log.last_index:
+                log[index] = entry
+            else:
+                log.append(entry)
 
-            if leader_commit > self.raft_state.commit_index:
-                self.raft_state.commit_index = min(leader_commit, len(self.raft_state.log))
-                self._apply_committed()
+        if leader_commit > self.raft_state.commit_index:
+            self.raft_state.commit_index = min(leader_commit, log.last_index)
 
-            return {'term': self.raft_state.current_term, 'success': True}
+        return {'term': self.raft_state.current_term, 'success': True}
 
     def _handle_client_request(self, request):
         with self.lock:
             if self.state != State.LEADER:
-                return {'ok': False, 'error': 'not leader', 'leader_id': self.leader_id}
+                return {'ok': False, 'error': 'not leader', 'leader_id': self.leader_id, 'leader_hint': self._leader_hint()}
 
             command = request['command']
             entry = LogEntry(
                 term=self.raft_state.current_term,
-                index=len(self.raft_state.log) + 1,
+                index=self.raft_state.log.last_index + 1,
                 command=command
             )
             self.raft_state.log.append(entry)
 
             return {'ok': True, 'index': entry.index}
 
+    def _leader_hint(self):
+        if self.leader_id == self.node_id:
+            return (self.host, self.port)
+        return self.peers.get(self.leader_id)
+
     def _get_status(self):
         with self.lock:
             return {
@@ -198,7 +307,8 @@ class RaftNode:
                 'state': self.state.name,
                 'term': self.raft_state.current_term,
                 'leader_id': self.leader_id,
-                'log_length': len(self.raft_state.log),
+                'leader_hint': self._leader_hint(),
+                'log_length': self.raft_state.log.last_index,
                 'commit_index': self.raft_state.commit_index,
                 'last_applied': self.raft_state.last_applied
             }
@@ -206,133 +316,194 @@ class RaftNode:
     def _election_loop(self):
         while self.running:
             time.sleep(0.1)
-            with self.lock:
-                if self.state == State.LEADER:
-                    continue
-                if time.time() - self.last_heartbeat > self.election_timeout:
-                    self._start_election()
+            self._start_election()
 
     def _start_election(self):
-        self.state = State.CANDIDATE
-        self.raft_state.current_term += 1
-        self.raft_state.voted_for = self.node_id
-        self._reset_election_timer()
-
-        votes = 1
-        term = self.raft_state.current_term
+        with self.lock:
+            if self.state == State.LEADER:
+                return
+            if time.time() - self.last_heartbeat <= self.election_timeout:
+                return
 
-        last_log_index = len(self.raft_state.log)
-        last_log_term = self.raft_state.log[-1].term if self.raft_state.log else 0
+            self.state = State.CANDIDATE
+            self.raft_state.current_term += 1
+            self.raft_state.voted_for = self.node_id
+            self._reset_election_timer()
 
-        for peer_id, (host, port) in self.peers.items():
-            response = self._send_rpc(host, port, {
+            term = self.raft_state.current_term
+            request = {
                 'cmd': 'request_vote',
                 'term': term,
                 'candidate_id': self.node_id,
-                'last_log_index': last_log_index,
-                'last_log_term': last_log_term
-            })
-
-            if response and response.get('vote_granted'):
-                votes += 1
+                'last_log_index': self.raft_state.log.last_index,
+                'last_log_term': self.raft_state.log.last_term
+            }
 
-            if response and response.get('term', 0) > term:
-                self.raft_state.current_term = response['term']
-                self.state = State.FOLLOWER
-                self.raft_state.voted_for = None
+            if not self.peers:
+                self._become_leader()
                 return
 
-        if votes > len(self.peers) // 2 and self.state == State.CANDIDATE:
-            self._become_leader()
+        futures = [
+            self._rpc_pool.submit(self._send_rpc, host, port, request)
+            for host, port in self.peers.values()
+        ]
+
+        votes = 1
+        for future in as_completed(futures):
+            response = future.result()
+            if not response:
+                continue
+
+            with self.lock:
+                if response.get('term', 0) > self.raft_state.current_term:
+                    self.raft_state.current_term = response['term']
+                    self.state = State.FOLLOWER
+                    self.raft_state.voted_for = None
+                    return
+
+                if self.state != State.CANDIDATE or self.raft_state.current_term != term:
+                    return
+
+                if response.get('vote_granted'):
+                    votes += 1
+                if votes > len(self.peers) // 2:
+                    self._become_leader()
+                    return
 
     def _become_leader(self):
         self.state = State.LEADER
         self.leader_id = self.node_id
 
         for peer_id in self.peers:
-            self.next_index[peer_id] = len(self.raft_state.log) + 1
+            self.next_index[peer_id] = self.raft_state.log.last_index + 1
             self.match_index[peer_id] = 0
 
     def _heartbeat_loop(self):
         while self.running:
             time.sleep(0.5)
             with self.lock:
-                if self.state == State.LEADER:
-                    self._send_heartbeats()
+                is_leader = self.state == State.LEADER
+            if is_leader:
+                self._send_heartbeats()
 
     def _send_heartbeats(self):
-        for peer_id, (host, port) in self.peers.items():
-            self._replicate_to_peer(peer_id, host, port)
+        futures = [
+            self._rpc_pool.submit(self._replicate_to_peer, peer_id, host, port)
+            for peer_id, (host, port) in self.peers.items()
+        ]
+        wait(futures)
 
     def _replicate_to_peer(self, peer_id, host, port):
-        prev_log_index = self.next_index.get(peer_id, 1) - 1
-        prev_log_term = 0
-        if prev_log_index > 0 and prev_log_index <= len(self.raft_state.log):
-            prev_log_term = self.raft_state.log[prev_log_index - 1].term
-
-        entries = []
-        for i in range(self.next_index.get(peer_id, 1) - 1, len(self.raft_state.log)):
-            entry = self.raft_state.log[i]
-            entries.append({'term': entry.term, 'index': entry.index, 'command': entry.command})
-
-        response = self._send_rpc(host, port, {
-            'cmd': 'append_entries',
-            'term': self.raft_state.current_term,
-            'leader_id': self.node_id,
-            'prev_log_index': prev_log_index,
-            'prev_log_term': prev_log_term,
-            'entries': entries,
-            'leader_commit': self.raft_state.commit_index
-        })
-
-        if response:
+        with self.lock:
+            if self.state != State.LEADER:
+                return
+
+            term = self.raft_state.current_term
+            next_index = self.next_index.get(peer_id, 1)
+            last_index = self.raft_state.log.last_index
+            request = self._append_entries_payload(next_index)
+
+        response = self._send_rpc(host, port, request)
+        if not response:
+            return
+
+        with self.lock:
             if response.get('term', 0) > self.raft_state.current_term:
                 self.raft_state.current_term = response['term']
                 self.state = State.FOLLOWER
                 self.raft_state.voted_for = None
                 return
 
+            if self.state != State.LEADER or self.raft_state.current_term != term:
+                return
+
             if response.get('success'):
-                if entries:
-                    self.next_index[peer_id] = entries[-1]['index'] + 1
-                    self.match_index[peer_id] = entries[-1]['index']
+                if last_index >= next_index:
+                    self.next_index[peer_id] = last_index + 1
+                    self.match_index[peer_id] = last_index
                     self._update_commit_index()
             else:
-                self.next_index[peer_id] = max(1, self.next_index.get(peer_id, 1) - 1)
+                self.next_index[peer_id] = max(1, next_index - 1)
 
-    def _update_commit_index(self):
-        for n in range(self.raft_state.commit_index + 1, len(self.raft_state.log) + 1):
-            if self.raft_state.log[n - 1].term != self.raft_state.current_term:
-                continue
+        self._apply_committed()
 
-            replicated = 1
-            for peer_id in self.peers:
-                if self.match_index.get(peer_id, 0) >= n:
-                    replicated += 1
+    def _append_entries_payload(self, next_index):
+        log = self.raft_state.log
+        epoch = (self.raft_state.current_term, log.last_index, self.raft_state.commit_index)
+        if epoch != self._payload_epoch:
+            self._payload_epoch = epoch
+            self._payload_cache.clear()
+        else:
+            payload = self._payload_cache.get(next_index)
+            if payload is not None:
+                return payload
+
+        prev_log_index = next_index - 1
+        prev_log_term = 0
+        if log.offset <= prev_log_index <= log.last_index:
+            prev_log_term = log.term_at(prev_log_index)
 
-            if replicated > len(self.peers) // 2:
-                self.raft_state.commit_index = n
+        entries = b','.join(entry.encoded() for entry in log.slice(next_index, log.last_index + 1))
+        payload = (
+            b'{"cmd":"append_entries","term":%d,"leader_id":%s,"prev_log_index":%d,'
+            b'"prev_log_term":%d,"entries":[%s],"leader_commit":%d}'
+        ) % (
+            self.raft_state.current_term, dumps(self.node_id), prev_log_index,
+            prev_log_term, entries, self.raft_state.commit_index
+        )
 
-        self._apply_committed()
+        self._payload_cache[next_index] = payload
+        return payload
+
+    def _update_commit_index(self):
+        log = self.raft_state.log
+        matches = sorted([self.match_index.get(peer_id, 0) for peer_id in self.peers], reverse=True)
+        matches.insert(0, log.last_index)
+        n = matches[(len(self.peers) + 1) // 2]
+        if n > self.raft_state.commit_index and log[n].term == self.raft_state.current_term:
+            self.raft_state.commit_index = n
 
     def _apply_committed(self):
-        while self.raft_state.last_applied < self.raft_state.commit_index:
-            self.raft_state.last_applied += 1
-            entry = self.raft_state.log[self.raft_state.last_applied - 1]
-            if self.apply_callback:
-                self.apply_callback(entry)
+        with self._apply_lock:
+            with self.lock:
+                last_applied = self.raft_state.last_applied
+                commit_index = self.raft_state.commit_index
+                if last_applied >= commit_index:
+                    return
+                entries = self.raft_state.log.slice(last_applied + 1, commit_index + 1)
+
+            if self.batch_apply_callback:
+                self.batch_apply_callback(entries)
+            elif self.apply_callback:
+                for entry in entries:
+                    self.apply_callback(entry)
+
+            with self.lock:
+                self.raft_state.last_applied = commit_index
 
     def _send_rpc(self, host, port, request):
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(1.0)
-            sock.connect((host, port))
-            sock.sendall(json.dumps(request).encode())
-            response = json.loads(sock.recv(65536).decode())
-            sock.close()
-            return response
-        except:
-            return None
+        addr = (host, port)
+        lock = self._peer_locks.get(addr)
+        if lock is None:
+            lock = self._peer_locks.setdefault(addr, threading.Lock())
+
+        with lock:
+            sock = self._peer_sockets.get(addr)
+            try:
+                if sock is None:
+                    sock = socket.create_connection(addr, timeout=1.0)
+                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    self._peer_sockets[addr] = sock
+                if isinstance(request, bytes):
+                    send_frame(sock, request)
+                else:
+                    send_message(sock, request)
+                return recv_message(sock)
+            except Exception:
+                self._peer_sockets.pop(addr, None)
+                if sock is not None:
+                    sock.close()
+                return None
 
 if __name__ == '__main__':
     import sys
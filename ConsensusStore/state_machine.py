@@ -1,91 +1,138 @@
 import threading
 import json
+from bisect import bisect_left, insort
 from typing import Any, Dict, Optional
 
-class KeyValueStateMachine:
+_DELETED = object()
+
+def _op_unknown(self, command):
+    return {'ok': False, 'error': 'unknown operation'}
+
+class StateMachine:
+    _OPS = {}
+
+    def apply(self, entry):
+        with self.lock:
+            return self._apply(entry)
+
+    def apply_batch(self, entries):
+        with self.lock:
+            return [self._apply(entry) for entry in entries]
+
+    def _apply(self, entry):
+        command = entry.command
+        result = self._OPS.get(command.get('op'), _op_unknown)(self, command)
+        self.last_applied = entry.index
+        return result
+
+class KeyValueStateMachine(StateMachine):
     def __init__(self):
         self.data: Dict[str, Any] = {}
+        self._overlay: Optional[Dict[str, Any]] = None
         self.lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
         self.last_applied = 0
 
-    def apply(self, entry):
-        with self.lock:
-            command = entry.command
-            op = command.get('op')
-
-            if op == 'set':
-                self.data[command['key']] = command['value']
-                result = {'ok': True}
-            elif op == 'get':
-                value = self.data.get(command['key'])
-                result = {'ok': True, 'value': value}
-            elif op == 'delete':
-                self.data.pop(command['key'], None)
-                result = {'ok': True}
-            elif op == 'cas':
-                current = self.data.get(command['key'])
-                if current == command['expected']:
-                    self.data[command['key']] = command['value']
-                    result = {'ok': True, 'swapped': True}
-                else:
-                    result = {'ok': True, 'swapped': False, 'current': current}
-            else:
-                result = {'ok': False, 'error': 'unknown operation'}
-
-            self.last_applied = entry.index
-            return result
+    def _read(self, key):
+        if self._overlay is not None and key in self._overlay:
+            value = self._overlay[key]
+            return None if value is _DELETED else value
+        return self.data.get(key)
+
+    def _write(self, key, value):
+        if self._overlay is not None:
+            self._overlay[key] = value
+        else:
+            self.data[key] = value
+
+    def _delete(self, key):
+        if self._overlay is not None:
+            self._overlay[key] = _DELETED
+        else:
+            self.data.pop(key, None)
+
+    def _op_set(self, command):
+        self._write(command['key'], command['value'])
+        return {'ok': True}
+
+    def _op_get(self, command):
+        return {'ok': True, 'value': self._read(command['key'])}
+
+    def _op_delete(self, command):
+        self._delete(command['key'])
+        return {'ok': True}
+
+    def _op_cas(self, command):
+        key = command['key']
+        current = self._read(key)
+        if current == command['expected']:
+            self._write(key, command['value'])
+            return {'ok': True, 'swapped': True}
+        return {'ok': True, 'swapped': False, 'current': current}
+
+    _OPS = {'set': _op_set, 'get': _op_get, 'delete': _op_delete, 'cas': _op_cas}
 
     def get(self, key):
         with self.lock:
-            return self.data.get(key)
+            return self._read(key)
 
     def snapshot(self):
-        with self.lock:
+        with self._snapshot_lock:
+            with self.lock:
+                self._overlay = {}
+                last_applied = self.last_applied
+
+            try:
+                data = dict(self.data)
+            finally:
+                with self.lock:
+                    overlay = self._overlay
+                    self._overlay = None
+                    for key, value in overlay.items():
+                        if value is _DELETED:
+                            self.data.pop(key, None)
+                        else:
+                            self.data[key] = value
+
             return {
-                'data': dict(self.data),
-                'last_applied': self.last_applied
+                'data': data,
+                'last_applied': last_applied
             }
 
     def restore(self, snapshot):
-        with self.lock:
+        with self._snapshot_lock, self.lock:
             self.data = dict(snapshot['data'])
             self.last_applied = snapshot['last_applied']
 
-class LockStateMachine:
+class LockStateMachine(StateMachine):
     def __init__(self):
         self.locks: Dict[str, Optional[str]] = {}
         self.lock = threading.Lock()
         self.last_applied = 0
 
-    def apply(self, entry):
-        with self.lock:
-            command = entry.command
-            op = command.get('op')
-            lock_name = command.get('lock')
-            owner = command.get('owner')
-
-            if op == 'acquire':
-                if lock_name not in self.locks or self.locks[lock_name] is None:
-                    self.locks[lock_name] = owner
-                    result = {'ok': True, 'acquired': True}
-                elif self.locks[lock_name] == owner:
-                    result = {'ok': True, 'acquired': True, 'already_held': True}
-                else:
-                    result = {'ok': True, 'acquired': False, 'holder': self.locks[lock_name]}
-            elif op == 'release':
-                if self.locks.get(lock_name) == owner:
-                    self.locks[lock_name] = None
-                    result = {'ok': True, 'released': True}
-                else:
-                    result = {'ok': False, 'error': 'not lock holder'}
-            elif op == 'status':
-                holder = self.locks.get(lock_name)
-                result = {'ok': True, 'lock': lock_name, 'holder': holder}
-            else:
-                result = {'ok': False, 'error': 'unknown operation'}
-
-            self.last_applied = entry.index
-            return result
+    def _op_acquire(self, command):
+        lock_name = command.get('lock')
+        owner = command.get('owner')
+        holder = self.locks.get(lock_name)
+        if holder is None:
+            self.locks[lock_name] = owner
+            return {'ok': True, 'acquired': True}
+        if holder == owner:
+            return {'ok': True, 'acquired': True, 'already_held': True}
+        return {'ok': True, 'acquired': False, 'holder': holder}
+
+    def _op_release(self, command):
+        lock_name = command.get('lock')
+        if self.locks.get(lock_name) == command.get('owner'):
+            self.locks[lock_name] = None
+            return {'ok': True, 'released': True}
+        return {'ok': False, 'error': 'not lock holder'}
+
+    def _op_status(self, command):
+        lock_name = command.get('lock')
+        return {'ok': True, 'lock': lock_name, 'holder': self.locks.get(lock_name)}
+
+    _OPS = {'acquire': _op_acquire, 'release': _op_release, 'status': _op_status}
 
     def snapshot(self):
         with self.lock:
@@ -99,50 +146,60 @@ class LockStateMachine:
             self.locks = dict(snapshot['locks'])
             self.last_applied = snapshot['last_applied']
 
-class ConfigStateMachine:
+class ConfigStateMachine(StateMachine):
     def __init__(self):
         self.config: Dict[str, Any] = {}
+        self._keys = []
         self.version = 0
         self.lock = threading.Lock()
         self.last_applied = 0
         self.watchers = {}
 
-    def apply(self, entry):
-        with self.lock:
-            command = entry.command
-            op = command.get('op')
-
-            if op == 'set':
-                key = command['key']
-                self.config[key] = command['value']
-                self.version += 1
-                result = {'ok': True, 'version': self.version}
-            elif op == 'get':
-                key = command['key']
-                value = self.config.get(key)
-                result = {'ok': True, 'value': value, 'version': self.version}
-            elif op == 'delete':
-                key = command['key']
-                self.config.pop(key, None)
-                self.version += 1
-                result = {'ok': True, 'version': self.version}
-            elif op == 'list':
-                prefix = command.get('prefix', '')
-                matching = {k: v for k, v in self.config.items() if k.startswith(prefix)}
-                result = {'ok': True, 'config': matching, 'version': self.version}
-            elif op == 'batch':
-                for item in command.get('ops', []):
-                    if item['op'] == 'set':
-                        self.config[item['key']] = item['value']
-                    elif item['op'] == 'delete':
-                        self.config.pop(item['key'], None)
-                self.version += 1
-                result = {'ok': True, 'version': self.version}
-            else:
-                result = {'ok': False, 'error': 'unknown operation'}
-
-            self.last_applied = entry.index
-            return result
+    def _set_key(self, key, value):
+        if key not in self.config:
+            insort(self._keys, key)
+        self.config[key] = value
+
+    def _delete_key(self, key):
+        if key in self.config:
+            del self.config[key]
+            del self._keys[bisect_left(self._keys, key)]
+
+    def _op_set(self, command):
+        self._set_key(command['key'], command['value'])
+        self.version += 1
+        return {'ok': True, 'version': self.version}
+
+    def _op_get(self, command):
+        return {'ok': True, 'value': self.config.get(command['key']), 'version': self.version}
+
+    def _op_delete(self, command):
+        self._delete_key(command['key'])
+        self.version += 1
+        return {'ok': True, 'version': self.version}
+
+    def _op_list(self, command):
+        prefix = command.get('prefix', '')
+        keys = self._keys
+        config = self.config
+        matching = {}
+        for i in range(bisect_left(keys, prefix), len(keys)):
+            key = keys[i]
+            if not key.startswith(prefix):
+                break
+            matching[key] = config[key]
+        return {'ok': True, 'config': matching, 'version': self.version}
+
+    def _op_batch(self, command):
+        for item in command.get('ops', []):
+            if item['op'] == 'set':
+                self._set_key(item['key'], item['value'])
+            elif item['op'] == 'delete':
+                self._delete_key(item['key'])
+        self.version += 1
+        return {'ok': True, 'version': self.version}
+
+    _OPS = {'set': _op_set, 'get': _op_get, 'delete': _op_delete, 'list': _op_list, 'batch': _op_batch}
 
     def snapshot(self):
         with self.lock:
@@ -155,54 +212,49 @@ class ConfigStateMachine:
     def restore(self, snapshot):
         with self.lock:
             self.config = dict(snapshot['config'])
+            self._keys = sorted(self.config)
             self.version = snapshot['version']
             self.last_applied = snapshot['last_applied']
 
-class LeaderElectionStateMachine:
+class LeaderElectionStateMachine(StateMachine):
     def __init__(self):
         self.leaders: Dict[str, Dict] = {}
         self.lock = threading.Lock()
         self.last_applied = 0
 
-    def apply(self, entry):
-        with self.lock:
-            command = entry.command
-            op = command.get('op')
-            group = command.get('group')
-            node = command.get('node')
-
-            if op == 'campaign':
-                if group not in self.leaders:
-                    self.leaders[group] = {'leader': node, 'term': 1}
-                    result = {'ok': True, 'elected': True, 'term': 1}
-                else:
-                    current = self.leaders[group]
-                    if current['leader'] is None:
-                        self.leaders[group] = {'leader': node, 'term': current['term'] + 1}
-                        result = {'ok': True, 'elected': True, 'term': self.leaders[group]['term']}
-                    else:
-                        result = {'ok': True, 'elected': False, 'current_leader': current['leader']}
-            elif op == 'resign':
-                if group in self.leaders and self.leaders[group]['leader'] == node:
-                    self.leaders[group]['leader'] = None
-                    result = {'ok': True, 'resigned': True}
-                else:
-                    result = {'ok': False, 'error': 'not the leader'}
-            elif op == 'heartbeat':
-                if group in self.leaders and self.leaders[group]['leader'] == node:
-                    result = {'ok': True, 'renewed': True}
-                else:
-                    result = {'ok': False, 'error': 'not the leader'}
-            elif op == 'get_leader':
-                if group in self.leaders:
-                    result = {'ok': True, 'leader': self.leaders[group]['leader'], 'term': self.leaders[group]['term']}
-                else:
-                    result = {'ok': True, 'leader': None}
-            else:
-                result = {'ok': False, 'error': 'unknown operation'}
-
-            self.last_applied = entry.index
-            return result
+    def _op_campaign(self, command):
+        group = command.get('group')
+        node = command.get('node')
+        current = self.leaders.get(group)
+        if current is None:
+            self.leaders[group] = {'leader': node, 'term': 1}
+            return {'ok': True, 'elected': True, 'term': 1}
+        if current['leader'] is None:
+            term = current['term'] + 1
+            self.leaders[group] = {'leader': node, 'term': term}
+            return {'ok': True, 'elected': True, 'term': term}
+        return {'ok': True, 'elected': False, 'current_leader': current['leader']}
+
+    def _op_resign(self, command):
+        current = self.leaders.get(command.get('group'))
+        if current is not None and current['leader'] == command.get('node'):
+            current['leader'] = None
+            return {'ok': True, 'resigned': True}
+        return {'ok': False, 'error': 'not the leader'}
+
+    def _op_heartbeat(self, command):
+        current = self.leaders.get(command.get('group'))
+        if current is not None and current['leader'] == command.get('node'):
+            return {'ok': True, 'renewed': True}
+        return {'ok': False, 'error': 'not the leader'}
+
+    def _op_get_leader(self, command):
+        current = self.leaders.get(command.get('group'))
+        if current is not None:
+            return {'ok': True, 'leader': current['leader'], 'term': current['term']}
+        return {'ok': True, 'leader': None}
+
+    _OPS = {'campaign': _op_campaign, 'resign': _op_resign, 'heartbeat': _op_heartbeat, 'get_leader': _op_get_leader}
 
     def snapshot(self):
         with self.lock:
@@ -1,7 +1,7 @@
 import http.server
-import json
 from http import HTTPStatus
 from urllib.parse import urlparse, parse_qs
+from codec import dumps, loads
 
 class StoreInterface:
     def create_user(self, user_id, data): raise NotImplementedError
@@ -98,10 +98,10 @@ class APIHandler(http.server.BaseHTTPRequestHandler):
         length = int(self.headers.get('Content-Length', 0))
         if length == 0:
             return {}
-        return json.loads(self.rfile.read(length))
+        return loads(self.rfile.read(length))
 
     def _send_json(self, data, status=HTTPStatus.OK):
-        body = json.dumps(data).encode()
+        body = dumps(data)
         self.send_response(status)
         self.send_header('Content-Type', 'application/json')
         self.send_header('Content-Length', len(body))
@@ -109,7 +109,7 @@ class APIHandler(http.server.BaseHTTPRequestHandler):
         self.wfile.write(body)
 
     def _send_error(self, status, message):
-        body = json.dumps({'error': message}).encode()
+        body = dumps({'error': message})
         self.send_response(status)
         self.send_header('Content-Type', 'application/json')
         self.send_header('Content-Length', len(body))
@@ -1,40 +1,126 @@
-import json
-import os
+import sqlite3
 import threading
+from collections import OrderedDict
 from pathlib import Path
+from codec import dumps, loads
+
+CACHE_SIZE = 10000
+NEGATIVE_CACHE_SIZE = 4096
 
 class DocumentStore:
     def __init__(self, data_dir='document_data'):
         self.data_dir = Path(data_dir)
-        self.users_dir = self.data_dir / 'users'
-        self.rels_dir = self.data_dir / 'relationships'
-        self.users_dir.mkdir(parents=True, exist_ok=True)
-        self.rels_dir.mkdir(parents=True, exist_ok=True)
+        self.data_dir.mkdir(parents=True, exist_ok=True)
         self.lock = threading.Lock()
-
-    def _user_path(self, user_id):
-        return self.users_dir / f'{user_id}.json'
-
-    def _rels_path(self, user_id):
-        return self.rels_dir / f'{user_id}.json'
+        self.conn = sqlite3.connect(str(self.data_dir / 'documents.db'), isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS users (
+                id TEXT PRIMARY KEY,
+                doc BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS relationships (
+                from_id TEXT,
+                to_id TEXT,
+                type TEXT,
+                PRIMARY KEY (from_id, to_id, type)
+            );
+        ''')
+        self._text_index = {}
+        self._value_index = {}
+        self._indexed = {}
+        self._users = OrderedDict()
+        self._rels = OrderedDict()
+        self._negative = OrderedDict()
+        self._import_files()
+        for user_id, doc in self.conn.execute('SELECT id, doc FROM users'):
+            self._index_doc(user_id, loads(doc))
+
+    def _import_files(self):
+        if self.conn.execute('SELECT 1 FROM users LIMIT 1').fetchone():
+            return
+        users = []
+        for path in (self.data_dir / 'users').rglob('*.json'):
+            users.append((path.stem, path.read_bytes()))
+        rels = []
+        for path in (self.data_dir / 'relationships').rglob('*.json'):
+            rels += [(path.stem, r['to'], r['type']) for r in loads(path.read_bytes())]
+        with self.conn:
+            self.conn.execute('BEGIN')
+            self.conn.executemany('INSERT OR REPLACE INTO users VALUES (?, ?)', users)
+            self.conn.executemany('INSERT OR IGNORE INTO relationships VALUES (?, ?, ?)', rels)
+
+    def _index_doc(self, user_id, doc):
+        fields = {}
+        for key, value in doc.items():
+            if isinstance(value, str):
+                index, term = self._text_index, value.lower()
+            else:
+                index, term = self._value_index, str(value)
+            index.setdefault(key, {}).setdefault(term, set()).add(user_id)
+            fields[key] = (index, term)
+        self._indexed[user_id] = fields
+
+    def _unindex_doc(self, user_id):
+        for key, (index, term) in self._indexed.pop(user_id, {}).items():
+            ids = index[key][term]
+            ids.discard(user_id)
+            if not ids:
+                del index[key][term]
+
+    def _match_ids(self, key, exact, needle):
+        ids = set(self._value_index.get(key, {}).get(exact, ()))
+        for term, term_ids in self._text_index.get(key, {}).items():
+            if needle in term:
+                ids |= term_ids
+        return ids
+
+    def _cached(self, cache, key):
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+    def _cache(self, cache, key, value):
+        cache[key] = value
+        if len(cache) > CACHE_SIZE:
+            cache.popitem(last=False)
 
     def create_user(self, user_id, data):
         with self.lock:
             doc = dict(data)
             doc['_id'] = user_id
-            with open(self._user_path(user_id), 'w') as f:
-                json.dump(doc, f)
+            self.conn.execute('INSERT OR REPLACE INTO users VALUES (?, ?)', (user_id, dumps(doc)))
+            self._users.pop(user_id, None)
+            self._negative.pop(user_id, None)
+            self._unindex_doc(user_id)
+            self._index_doc(user_id, doc)
+
+    def _load_user(self, user_id):
+        doc = self._cached(self._users, user_id)
+        if doc is not None:
+            return doc
+        if user_id in self._negative:
+            return None
 
-    def get_user(self, user_id):
-        path = self._user_path(user_id)
-        if not path.exists():
+        row = self.conn.execute('SELECT doc FROM users WHERE id = ?', (user_id,)).fetchone()
+        if row is None:
+            self._negative[user_id] = None
+            if len(self._negative) > NEGATIVE_CACHE_SIZE:
+                self._negative.popitem(last=False)
             return None
-        with open(path) as f:
-            doc = json.load(f)
-        result = dict(doc)
-        if '_id' in result:
-            result['id'] = result.pop('_id')
-        return result
+
+        doc = loads(row[0])
+        if '_id' in doc:
+            doc['id'] = doc.pop('_id')
+        self._cache(self._users, user_id, doc)
+        return doc
+
+    def get_user(self, user_id):
+        with self.lock:
+            doc = self._load_user(user_id)
+        return dict(doc) if doc is not None else None
 
     def update_user(self, user_id, data):
         existing = self.get_user(user_id)
@@ -44,71 +130,48 @@ class DocumentStore:
 
     def delete_user(self, user_id):
         with self.lock:
-            path = self._user_path(user_id)
-            if path.exists():
-                path.unlink()
-            rels_path = self._rels_path(user_id)
-            if rels_path.exists():
-                rels_path.unlink()
+            with self.conn:
+                self.conn.execute('BEGIN')
+                self.conn.execute('DELETE FROM users WHERE id = ?', (user_id,))
+                self.conn.execute('DELETE FROM relationships WHERE from_id = ?', (user_id,))
+            self._unindex_doc(user_id)
+            self._users.pop(user_id, None)
+            self._rels.pop(user_id, None)
 
     def add_relationship(self, from_id, to_id, rel_type):
         with self.lock:
-            rels_path = self._rels_path(from_id)
-            if rels_path.exists():
-                with open(rels_path) as f:
-                    rels = json.load(f)
-            else:
-                rels = []
-
-            for r in rels:
-                if r['to'] == to_id and r['type'] == rel_type:
-                    return
-
-            rels.append({'to': to_id, 'type': rel_type})
-
-            with open(rels_path, 'w') as f:
-                json.dump(rels, f)
+            cursor = self.conn.execute('INSERT OR IGNORE INTO relationships VALUES (?, ?, ?)', (from_id, to_id, rel_type))
+            if cursor.rowcount:
+                rels = self._rels.get(from_id)
+                if rels is not None:
+                    rels.append({'to': to_id, 'type': rel_type})
 
     def get_relationships(self, user_id, rel_type=None):
-        rels_path = self._rels_path(user_id)
-        if not rels_path.exists():
-            return []
-
-        with open(rels_path) as f:
-            rels = json.load(f)
+        with self.lock:
+            rels = self._cached(self._rels, user_id)
+            if rels is None:
+                rows = self.conn.execute('SELECT to_id, type FROM relationships WHERE from_id = ? ORDER BY rowid', (user_id,))
+                rels = [{'to': to_id, 'type': type_} for to_id, type_ in rows]
+                if not rels:
+                    return []
+                self._cache(self._rels, user_id, rels)
 
         if rel_type:
-            rels = [r for r in rels if r['type'] == rel_type]
+            return [r for r in rels if r['type'] == rel_type]
 
-        return rels
+        return list(rels)
 
     def query_users(self, filters):
-        results = []
-        for path in self.users_dir.glob('*.json'):
-            with open(path) as f:
-                doc = json.load(f)
-
-            match = True
-            for key, value in filters.items():
-                if key not in doc:
-                    match = False
-                    break
-                doc_value = doc[key]
-                if isinstance(doc_value, str):
-                    if value.lower() not in doc_value.lower():
-                        match = False
-                        break
-                else:
-                    if str(doc_value) != str(value):
-                        match = False
-                        break
-
-            if match:
-                result = dict(doc)
-                if '_id' in result:
-                    result['id'] = result.pop('_id')
-                results.append(result)
-
-        return results
-
-
+        terms = [(key, str(value), str(value).lower()) for key, value in filters.items()]
+        with self.lock:
+            candidates = None
+            for key, exact, needle in terms:
+                ids = self._match_ids(key, exact, needle)
+                candidates = ids if candidates is None else candidates & ids
+                if not candidates:
+                    return []
+            if candidates is None:
+                candidates = list(self._indexed)
+            docs = [self._load_user(user_id) for user_id in candidates]
+
+        return [dict(doc) for doc in docs if doc is not None]
@@ -0,0 +1,14 @@
+try:
+    from orjson import OPT_NON_STR_KEYS, loads
+    from orjson import dumps as _dumps
+
+    def dumps(obj):
+        return _dumps(obj, option=OPT_NON_STR_KEYS)
+except ImportError:
+    import json
+
+    _encode = json.JSONEncoder(separators=(',', ':')).encode
+    loads = json.loads
+
+    def dumps(obj):
+        return _encode(obj).encode()
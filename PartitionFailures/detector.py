@@ -1,64 +1,90 @@
 import math
 import time
 import threading
-from collections import deque
+from array import array
 
 class PhiAccrualDetector:
+    _K = math.pi / math.sqrt(6)
+
     def __init__(self, threshold=8.0, window_size=100, min_std_dev=500):
         self.threshold = threshold
         self.window_size = window_size
         self.min_std_dev = min_std_dev
-        self.heartbeat_history = {}
+        self._min_std_dev_ns = min_std_dev * 1_000_000
+        self.slots = {}
+        self._intervals = array('q')
+        self._heads = array('l')
+        self._counts = array('l')
+        self.interval_sums = {}
+        self.estimates = {}
         self.last_heartbeat = {}
         self.lock = threading.Lock()
 
     def heartbeat(self, node_id):
         with self.lock:
-            now = time.time() * 1000
-
-            if node_id not in self.heartbeat_history:
-                self.heartbeat_history[node_id] = deque(maxlen=self.window_size)
+            now = time.monotonic_ns()
+
+            slot = self.slots.get(node_id)
+            if slot is None:
+                self.slots[node_id] = len(self._heads)
+                self._intervals.frombytes(bytes(8 * self.window_size))
+                self._heads.append(0)
+                self._counts.append(0)
+                self.interval_sums[node_id] = [0, 0]
             else:
-                if self.last_heartbeat.get(node_id):
-                    interval = now - self.last_heartbeat[node_id]
-                    self.heartbeat_history[node_id].append(interval)
+                last = self.last_heartbeat.get(node_id)
+                if last:
+                    interval = now - last
+                    sums = self.interval_sums[node_id]
+                    window = self.window_size
+                    head = self._heads[slot]
+                    i = slot * window + head
+                    n = self._counts[slot]
+                    if n == window:
+                        evicted = self._intervals[i]
+                        sums[0] -= evicted
+                        sums[1] -= evicted * evicted
+                    else:
+                        n = self._counts[slot] = n + 1
+                    self._intervals[i] = interval
+                    self._heads[slot] = head + 1 if head + 1 < window else 0
+                    total = sums[0] = sums[0] + interval
+                    total_sq = sums[1] = sums[1] + interval * interval
+
+                    if n >= 2:
+                        variance = (n * total_sq - total * total) / (n * n)
+                        self.estimates[node_id] = (total / n, max(math.sqrt(variance), self._min_std_dev_ns))
 
             self.last_heartbeat[node_id] = now
 
     def phi(self, node_id):
-        with self.lock:
-            if node_id not in self.last_heartbeat:
-                return float('inf')
+        last = self.last_heartbeat.get(node_id)
+        if last is None:
+            return float('inf')
+        return self._phi(time.monotonic_ns() - last, self.estimates.get(node_id))
 
-            history = self.heartbeat_history.get(node_id)
-            if not history or len(history) < 2:
-                return 0.0
+    def _phi(self, time_since_last, estimate):
+        if estimate is None:
+            return 0.0
 
-            now = time.time() * 1000
-            time_since_last = now - self.last_heartbeat[node_id]
+        mean, std_dev = estimate
+        y = (time_since_last - mean) / std_dev
+        if y > 40:
+            return float('inf')
 
-            mean = sum(history) / len(history)
-            variance = sum((x - mean) ** 2 for x in history) / len(history)
-            std_dev = max(math.sqrt(variance), self.min_std_dev)
-
-            y = (time_since_last - mean) / std_dev
-            e = math.exp(-y * (math.pi / math.sqrt(6)))
-            p = 1.0 / (1.0 + e)
-
-            if p == 0:
-                return float('inf')
-
-            return -math.log10(p)
+        e = math.exp(-y * self._K)
+        return -math.log10(e / (1.0 + e))
 
     def is_alive(self, node_id):
         return self.phi(node_id) < self.threshold
 
     def get_all_phi(self):
-        with self.lock:
-            return {
-                node_id: self.phi(node_id)
-                for node_id in self.last_heartbeat
-            }
+        now = time.monotonic_ns()
+        estimates = self.estimates
+        return {
+            node_id: self._phi(now - last, estimates.get(node_id))
+            for node_id, last in list(self.last_heartbeat.items())
+        }
 
 class AdaptiveDetector:
     def __init__(self, base_timeout=5.0, alpha=0.1):
@@ -71,7 +97,7 @@ class AdaptiveDetector:
 
     def heartbeat(self, node_id, rtt=None):
         with self.lock:
-            now = time.time()
+            now = time.monotonic()
 
             if rtt is not None:
                 if node_id not in self.estimated_rtt:
@@ -87,21 +113,23 @@ class AdaptiveDetector:
 
     def get_timeout(self, node_id):
         with self.lock:
-            if node_id not in self.estimated_rtt:
-                return self.base_timeout
+            return self._timeout(node_id)
 
-            return self.estimated_rtt[node_id] + 4 * self.rtt_variance[node_id]
+    def _timeout(self, node_id):
+        if node_id not in self.estimated_rtt:
+            return self.base_timeout
+
+        return self.estimated_rtt[node_id] + 4 * self.rtt_variance[node_id]
 
     def is_alive(self, node_id):
         with self.lock:
             if node_id not in self.last_heartbeat:
                 return False
 
-            timeout = self.get_timeout(node_id)
-            return time.time() - self.last_heartbeat[node_id] < timeout
+            return time.monotonic() - self.last_heartbeat[node_id] < self._timeout(node_id)
 
 class GossipDetector:
-    def __init__(self, local_node_id, gossip_interval=1.0, suspect_timeout=5.0, fail_timeout=15.0):
+    def __init__(self, local_node_id, gossip_interval=1.0, suspect_timeout=5.0, fail_timeout=15.0, send=None):
         self.local_node_id = local_node_id
         self.gossip_interval = gossip_interval
         self.suspect_timeout = suspect_timeout
@@ -110,24 +138,74 @@ class GossipDetector:
         self.last_update = {}
         self.suspected = set()
         self.failed = set()
+        self._snapshot = (frozenset(), frozenset(), frozenset())
         self.lock = threading.Lock()
+        self.send = send
+        self._outbox = {}
+        self.running = True
+
+    def add_peer(self, peer_id):
+        with self.lock:
+            if peer_id in self._outbox:
+                return
+            self._outbox[peer_id] = {}
+        if self.send:
+            threading.Thread(target=self._send_loop, args=(peer_id,), daemon=True).start()
+
+    def stop(self):
+        self.running = False
+
+    def _enqueue(self, deltas):
+        for peer_id in self._outbox:
+            self._enqueue_to(peer_id, deltas)
+
+    def _send_loop(self, peer_id):
+        while self.running:
+            time.sleep(self.gossip_interval)
+            with self.lock:
+                pending = self._outbox[peer_id]
+                if not pending:
+                    continue
+                self._outbox[peer_id] = {}
+            try:
+                self.send(peer_id, pending)
+            except Exception:
+                with self.lock:
+                    self._enqueue_to(peer_id, pending)
+
+    def _enqueue_to(self, peer_id, deltas):
+        pending = self._outbox[peer_id]
+        for node_id, counter in deltas.items():
+            if counter > pending.get(node_id, -1):
+                pending[node_id] = counter
+
+    def _publish(self):
+        alive = self.heartbeat_counters.keys() - self.suspected - self.failed
+        self._snapshot = (frozenset(alive), frozenset(self.suspected), frozenset(self.failed))
 
     def local_heartbeat(self):
         with self.lock:
             if self.local_node_id not in self.heartbeat_counters:
                 self.heartbeat_counters[self.local_node_id] = 0
-            self.heartbeat_counters[self.local_node_id] += 1
-            self.last_update[self.local_node_id] = time.time()
+                self._publish()
+            counter = self.heartbeat_counters[self.local_node_id] = self.heartbeat_counters[self.local_node_id] + 1
+            self.last_update[self.local_node_id] = time.monotonic()
+            self._enqueue({self.local_node_id: counter})
 
     def receive_gossip(self, remote_counters):
         with self.lock:
-            now = time.time()
+            now = time.monotonic()
+            deltas = {}
             for node_id, counter in remote_counters.items():
                 if node_id not in self.heartbeat_counters or counter > self.heartbeat_counters[node_id]:
                     self.heartbeat_counters[node_id] = counter
                     self.last_update[node_id] = now
                     self.suspected.discard(node_id)
                     self.failed.discard(node_id)
+                    deltas[node_id] = counter
+            if deltas:
+                self._enqueue(deltas)
+            self._publish()
 
     def get_gossip_state(self):
         with self.lock:
@@ -135,7 +213,7 @@ class GossipDetector:
 
     def check_nodes(self):
         with self.lock:
-            now = time.time()
+            now = time.monotonic()
             for node_id, last in list(self.last_update.items()):
                 if node_id == self.local_node_id:
                     continue
@@ -151,20 +229,15 @@ class GossipDetector:
                 else:
                     self.suspected.discard(node_id)
                     self.failed.discard(node_id)
+            self._publish()
 
     def get_alive_nodes(self):
-        with self.lock:
-            return [
-                node_id for node_id in self.heartbeat_counters
-                if node_id not in self.suspected and node_id not in self.failed
-            ]
+        return list(self._snapshot[0])
 
     def get_suspected_nodes(self):
-        with self.lock:
-            return list(self.suspected)
+        return list(self._snapshot[1])
 
     def get_failed_nodes(self):
-        with self.lock:
-            return list(self.failed)
+        return list(self._snapshot[2])
 
 
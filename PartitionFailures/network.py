@@ -1,48 +1,103 @@
 import socket
+import queue
 import threading
 import time
 import random
 from collections import defaultdict
+from protocol import frame, make_client_socket, recv_frame
 
 class NetworkSimulator:
     def __init__(self):
-        self.partitions = set()
-        self.latency = {}
-        self.packet_loss = {}
+        self._state = (frozenset(), {}, {})
+        self._ruled_nodes = frozenset()
         self.lock = threading.Lock()
 
+    def _publish(self, partitions, latency, packet_loss):
+        ruled = set()
+        for key in partitions:
+            ruled.update(key)
+        for key, value in latency.items():
+            if value:
+                ruled.update(key)
+        for key, value in packet_loss.items():
+            if value:
+                ruled.update(key)
+        self._ruled_nodes = frozenset(ruled)
+        self._state = (partitions, latency, packet_loss)
+
+    def _has_any_rules_for(self, node_id):
+        return node_id in self._ruled_nodes
+
+    @property
+    def partitions(self):
+        return self._state[0]
+
+    @property
+    def latency(self):
+        return self._state[1]
+
+    @property
+    def packet_loss(self):
+        return self._state[2]
+
+    @staticmethod
+    def pair_key(node_a, node_b):
+        return (node_a, node_b) if node_a <= node_b else (node_b, node_a)
+
+    def lookup(self, key):
+        partitions, latency, packet_loss = self._state
+        return key in partitions, latency.get(key, 0), packet_loss.get(key, 0)
+
     def add_partition(self, node_a, node_b):
         with self.lock:
-            self.partitions.add((min(node_a, node_b), max(node_a, node_b)))
+            partitions, latency, packet_loss = self._state
+            self._publish(partitions | {self.pair_key(node_a, node_b)}, latency, packet_loss)
 
     def remove_partition(self, node_a, node_b):
         with self.lock:
-            self.partitions.discard((min(node_a, node_b), max(node_a, node_b)))
+            partitions, latency, packet_loss = self._state
+            self._publish(partitions - {self.pair_key(node_a, node_b)}, latency, packet_loss)
+
+    def add_partitions(self, pairs):
+        with self.lock:
+            partitions, latency, packet_loss = self._state
+            added = frozenset(self.pair_key(a, b) for a, b in pairs)
+            self._publish(partitions | added, latency, packet_loss)
+
+    def remove_partitions(self, pairs):
+        with self.lock:
+            partitions, latency, packet_loss = self._state
+            removed = frozenset(self.pair_key(a, b) for a, b in pairs)
+            self._publish(partitions - removed, latency, packet_loss)
 
     def clear_partitions(self):
         with self.lock:
-            self.partitions.clear()
+            _, latency, packet_loss = self._state
+            self._publish(frozenset(), latency, packet_loss)
 
     def is_partitioned(self, node_a, node_b):
-        with self.lock:
-            return (min(node_a, node_b), max(node_a, node_b)) in self.partitions
+        return self.pair_key(node_a, node_b) in self._state[0]
 
     def set_latency(self, node_a, node_b, latency_ms):
         with self.lock:
-            self.latency[(min(node_a, node_b), max(node_a, node_b))] = latency_ms
+            partitions, latency, packet_loss = self._state
+            latency = dict(latency)
+            latency[self.pair_key(node_a, node_b)] = latency_ms
+            self._publish(partitions, latency, packet_loss)
 
     def get_latency(self, node_a, node_b):
-        with self.lock:
-            return self.latency.get((min(node_a, node_b), max(node_a, node_b)), 0)
+        return self._state[1].get(self.pair_key(node_a, node_b), 0)
 
     def set_packet_loss(self, node_a, node_b, loss_rate):
         with self.lock:
-            self.packet_loss[(min(node_a, node_b), max(node_a, node_b))] = loss_rate
+            partitions, latency, packet_loss = self._state
+            packet_loss = dict(packet_loss)
+            packet_loss[self.pair_key(node_a, node_b)] = loss_rate
+            self._publish(partitions, latency, packet_loss)
 
     def should_drop(self, node_a, node_b):
-        with self.lock:
-            rate = self.packet_loss.get((min(node_a, node_b), max(node_a, node_b)), 0)
-            return random.random() < rate
+        rate = self._state[2].get(self.pair_key(node_a, node_b), 0)
+        return random.random() < rate
 
 class ProxyNode:
     def __init__(self, node_id, real_host, real_port, proxy_port, network_sim):
@@ -53,6 +108,8 @@ class ProxyNode:
         self.network = network_sim
         self.running = False
         self.server_socket = None
+        self._pool = queue.LifoQueue(maxsize=32)
+        self._pair_cache = {}
 
     def start(self):
         self.running = True
@@ -66,6 +123,45 @@ class ProxyNode:
         self.running = False
         if self.server_socket:
             self.server_socket.close()
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def _connect_backend(self):
+        return make_client_socket(self.real_host, self.real_port, 5.0)
+
+    def _forward(self, data):
+        while True:
+            try:
+                real_sock = self._pool.get_nowait()
+                reused = True
+            except queue.Empty:
+                real_sock = self._connect_backend()
+                reused = False
+
+            stale = False
+            try:
+                try:
+                    real_sock.sendall(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    stale = True
+                    raise
+                from_node, payload = recv_frame(real_sock)
+                if payload is None:
+                    raise ConnectionError('backend closed connection')
+            except:
+                real_sock.close()
+                if reused and stale:
+                    continue
+                raise
+
+            try:
+                self._pool.put_nowait(real_sock)
+            except queue.Full:
+                real_sock.close()
+            return frame(payload, from_node)
 
     def _serve(self):
         while self.running:
@@ -77,40 +173,27 @@ class ProxyNode:
 
     def _handle(self, conn):
         try:
-            data = conn.recv(65536)
-            if not data:
-                return
-
-            import json
-            try:
-                request = json.loads(data.decode())
-                from_node = request.get('_from_node', -1)
-            except:
-                from_node = -1
-
-            if from_node >= 0 and self.network.is_partitioned(from_node, self.node_id):
-                conn.close()
-                return
-
-            if from_node >= 0 and self.network.should_drop(from_node, self.node_id):
-                conn.close()
-                return
-
-            latency = self.network.get_latency(from_node, self.node_id) if from_node >= 0 else 0
-            if latency > 0:
-                time.sleep(latency / 1000.0)
-
-            real_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            real_sock.settimeout(5.0)
-            real_sock.connect((self.real_host, self.real_port))
-            real_sock.sendall(data)
-            response = real_sock.recv(65536)
-            real_sock.close()
-
-            if latency > 0:
-                time.sleep(latency / 1000.0)
-
-            conn.sendall(response)
+            while self.running:
+                from_node, payload = recv_frame(conn)
+                if payload is None:
+                    return
+
+                latency = 0
+                if from_node >= 0 and self.network._has_any_rules_for(self.node_id):
+                    key = self._pair_cache.get(from_node)
+                    if key is None:
+                        key = self.network.pair_key(from_node, self.node_id)
+                        self._pair_cache[from_node] = key
+                    partitioned, latency, drop_rate = self.network.lookup(key)
+                    if partitioned or random.random() < drop_rate:
+                        return
+
+                response = self._forward(frame(payload, from_node))
+
+                if latency > 0:
+                    time.sleep(2 * latency / 1000.0)
+
+                conn.sendall(response)
         except:
             pass
         finally:
@@ -123,24 +206,16 @@ class PartitionManager:
         self.proxies = {}
 
     def create_partition(self, group_a, group_b):
-        for a in group_a:
-            for b in group_b:
-                self.network.add_partition(a, b)
+        self.network.add_partitions([(a, b) for a in group_a for b in group_b])
 
     def heal_partition(self, group_a, group_b):
-        for a in group_a:
-            for b in group_b:
-                self.network.remove_partition(a, b)
+        self.network.remove_partitions([(a, b) for a in group_a for b in group_b])
 
     def isolate_node(self, node_id):
-        for other_id in self.nodes:
-            if other_id != node_id:
-                self.network.add_partition(node_id, other_id)
+        self.network.add_partitions([(node_id, other_id) for other_id in self.nodes if other_id != node_id])
 
     def reconnect_node(self, node_id):
-        for other_id in self.nodes:
-            if other_id != node_id:
-                self.network.remove_partition(node_id, other_id)
+        self.network.remove_partitions([(node_id, other_id) for other_id in self.nodes if other_id != node_id])
 
     def get_partition_state(self):
         return list(self.network.partitions)
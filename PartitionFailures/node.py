@@ -1,8 +1,11 @@
+import asyncio
 import socket
-import json
 import threading
 import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from codec import dumps, loads
+from protocol import frame, make_client_socket, read_frame, recv_message, send_message, tune_socket
 
 class CounterNode:
     def __init__(self, node_id, host='localhost', port=12000):
@@ -15,8 +18,12 @@ class CounterNode:
         self.lock = threading.Lock()
         self.running = False
         self.server_socket = None
+        self.server_thread = None
+        self.loop = None
+        self.conns = set()
         self.heartbeat_thread = None
         self.last_heartbeat = {}
+        self.peer_socks = {}
         self.is_leader = False
         self.leader_id = None
         self.term = 0
@@ -25,16 +32,40 @@ class CounterNode:
         self.peers[node_id] = (host, port)
         self.last_heartbeat[node_id] = 0
 
+    def _apply_increment(self):
+        self.counter += 1
+        self.vector_clock[self.node_id] += 1
+
+    def _apply_decrement(self):
+        self.counter -= 1
+        self.vector_clock[self.node_id] += 1
+
+    def _apply_merge(self, request):
+        self._merge_clock(request['clock'])
+
+    def _merge_clock(self, remote_clock):
+        clock = self.vector_clock
+        for node, ts in remote_clock.items():
+            if ts > clock[node]:
+                clock[node] = ts
+
+    def _state(self):
+        return {'ok': True, 'counter': self.counter, 'clock': self.vector_clock}
+
+    def _respond(self, apply=None, *args):
+        with self.lock:
+            if apply:
+                apply(*args)
+            return dumps(self._state())
+
     def increment(self):
         with self.lock:
-            self.counter += 1
-            self.vector_clock[self.node_id] += 1
+            self._apply_increment()
             return self.counter, dict(self.vector_clock)
 
     def decrement(self):
         with self.lock:
-            self.counter -= 1
-            self.vector_clock[self.node_id] += 1
+            self._apply_decrement()
             return self.counter, dict(self.vector_clock)
 
     def get(self):
@@ -43,8 +74,7 @@ class CounterNode:
 
     def merge(self, remote_counter, remote_clock, remote_node):
         with self.lock:
-            for node, ts in remote_clock.items():
-                self.vector_clock[node] = max(self.vector_clock[node], ts)
+            self._merge_clock(remote_clock)
             return self.counter, dict(self.vector_clock)
 
     def sync_with_peer(self, peer_id):
@@ -53,9 +83,7 @@ class CounterNode:
 
         host, port = self.peers[peer_id]
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(2.0)
-            sock.connect((host, port))
+            sock = make_client_socket(host, port, 2.0)
 
             counter, clock = self.get()
             request = {
@@ -64,8 +92,8 @@ class CounterNode:
                 'counter': counter,
                 'clock': clock
             }
-            sock.sendall(json.dumps(request).encode())
-            response = json.loads(sock.recv(65536).decode())
+            send_message(sock, request, self.node_id)
+            response = recv_message(sock)
             sock.close()
 
             if response.get('ok'):
@@ -82,56 +110,71 @@ class CounterNode:
         self.server_socket.bind((self.host, self.port))
         self.server_socket.listen(5)
 
-        threading.Thread(target=self._serve, daemon=True).start()
+        self.loop = asyncio.new_event_loop()
+        self._stopped = asyncio.Event()
+        self.server_thread = threading.Thread(target=self._serve, daemon=True)
+        self.server_thread.start()
         self.heartbeat_thread = threading.Thread(target=self._heartbeat_loop, daemon=True)
         self.heartbeat_thread.start()
 
     def stop(self):
         self.running = False
-        if self.server_socket:
-            self.server_socket.close()
+        if self.loop and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._stopped.set)
+            if self.server_thread is not threading.current_thread():
+                self.server_thread.join(timeout=5.0)
+        for sock in list(self.peer_socks.values()):
+            sock.close()
 
     def _serve(self):
-        while self.running:
-            try:
-                conn, addr = self.server_socket.accept()
-                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
-            except:
-                break
-
-    def _handle(self, conn):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._main())
+        finally:
+            self.loop.close()
+
+    async def _main(self):
+        server = await asyncio.start_server(self._handle, sock=self.server_socket)
+        async with server:
+            await self._stopped.wait()
+        for writer in list(self.conns):
+            writer.close()
+        pending = asyncio.all_tasks() - {asyncio.current_task()}
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _handle(self, reader, writer):
+        tune_socket(writer.get_extra_info('socket'))
+        self.conns.add(writer)
         try:
-            data = conn.recv(65536)
-            if not data:
-                return
-            request = json.loads(data.decode())
-            response = self._process(request)
-            conn.sendall(json.dumps(response).encode())
+            while self.running:
+                _, payload = await read_frame(reader)
+                if payload is None or not self.running:
+                    return
+                response = self._process(loads(payload))
+                if not isinstance(response, bytes):
+                    response = dumps(response)
+                writer.write(frame(response, self.node_id))
+                await writer.drain()
+        except OSError:
+            pass
         finally:
-            conn.close()
+            self.conns.discard(writer)
+            writer.close()
 
     def _process(self, request):
         cmd = request.get('cmd')
 
         if cmd == 'get':
-            counter, clock = self.get()
-            return {'ok': True, 'counter': counter, 'clock': clock}
+            return self._respond()
 
         if cmd == 'increment':
-            counter, clock = self.increment()
-            return {'ok': True, 'counter': counter, 'clock': clock}
+            return self._respond(self._apply_increment)
 
         if cmd == 'decrement':
-            counter, clock = self.decrement()
-            return {'ok': True, 'counter': counter, 'clock': clock}
+            return self._respond(self._apply_decrement)
 
         if cmd == 'sync':
-            remote_counter = request['counter']
-            remote_clock = request['clock']
-            remote_node = request['node_id']
-            self.merge(remote_counter, remote_clock, remote_node)
-            counter, clock = self.get()
-            return {'ok': True, 'counter': counter, 'clock': clock}
+            return self._respond(self._apply_merge, request)
 
         if cmd == 'heartbeat':
             sender = request['node_id']
@@ -140,38 +183,63 @@ class CounterNode:
             return {'ok': True, 'node_id': self.node_id}
 
         if cmd == 'status':
-            return {
-                'ok': True,
-                'node_id': self.node_id,
-                'counter': self.counter,
-                'clock': dict(self.vector_clock),
-                'is_leader': self.is_leader,
-                'leader_id': self.leader_id,
-                'peers_alive': self._get_alive_peers()
-            }
+            peers_alive = self._get_alive_peers()
+            with self.lock:
+                return dumps({
+                    'ok': True,
+                    'node_id': self.node_id,
+                    'counter': self.counter,
+                    'clock': self.vector_clock,
+                    'is_leader': self.is_leader,
+                    'leader_id': self.leader_id,
+                    'peers_alive': peers_alive
+                })
 
         return {'ok': False, 'error': 'unknown command'}
 
     def _heartbeat_loop(self):
-        while self.running:
-            for peer_id, (host, port) in self.peers.items():
-                self._send_heartbeat(peer_id, host, port)
-            time.sleep(1.0)
+        pool = None
+        pool_size = 0
+        try:
+            while self.running:
+                peers = list(self.peers.items())
+                if pool is None or len(peers) > pool_size:
+                    if pool is not None:
+                        pool.shutdown()
+                    pool_size = max(1, len(peers))
+                    pool = ThreadPoolExecutor(max_workers=pool_size)
+                list(pool.map(lambda peer: self._send_heartbeat(peer[0], *peer[1]), peers))
+                time.sleep(1.0)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    def _exchange(self, sock, request):
+        send_message(sock, request, self.node_id)
+        return recv_message(sock)
 
     def _send_heartbeat(self, peer_id, host, port):
+        request = {'cmd': 'heartbeat', 'node_id': self.node_id}
+        sock = self.peer_socks.pop(peer_id, None)
+        response = None
+        if sock is not None:
+            try:
+                response = self._exchange(sock, request)
+            except Exception:
+                sock.close()
+                sock = None
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(1.0)
-            sock.connect((host, port))
-            request = {'cmd': 'heartbeat', 'node_id': self.node_id}
-            sock.sendall(json.dumps(request).encode())
-            response = json.loads(sock.recv(4096).decode())
-            sock.close()
-            if response.get('ok'):
-                with self.lock:
-                    self.last_heartbeat[peer_id] = time.time()
-        except:
-            pass
+            if sock is None:
+                sock = make_client_socket(host, port, 1.0)
+                response = self._exchange(sock, request)
+        except Exception:
+            if sock is not None:
+                sock.close()
+            return
+        self.peer_socks[peer_id] = sock
+        if response.get('ok'):
+            with self.lock:
+                self.last_heartbeat[peer_id] = time.time()
 
     def _get_alive_peers(self):
         now = time.time()
@@ -185,69 +253,68 @@ class GCounterNode(CounterNode):
     def __init__(self, node_id, host='localhost', port=12000):
         super().__init__(node_id, host, port)
         self.increments = defaultdict(int)
-
-    def increment(self):
-        with self.lock:
-            self.increments[self.node_id] += 1
-            self.counter = sum(self.increments.values())
-            self.vector_clock[self.node_id] += 1
-            return self.counter, dict(self.vector_clock)
+        self._inc_total = 0
+
+    def _join(self, counts, remote_counts):
+        delta = 0
+        for node, count in remote_counts.items():
+            old = counts[node]
+            if count > old:
+                counts[node] = count
+                delta += count - old
+        return delta
+
+    def _apply_increment(self):
+        self.increments[self.node_id] += 1
+        self._inc_total += 1
+        self.counter = self._inc_total
+        self.vector_clock[self.node_id] += 1
+
+    def _apply_merge(self, request):
+        self._inc_total += self._join(self.increments, request.get('increments', {}))
+        self.counter = self._inc_total
+        self._merge_clock(request['clock'])
+
+    def _state(self):
+        return {'ok': True, 'counter': self.counter, 'increments': self.increments, 'clock': self.vector_clock}
 
     def merge(self, remote_increments, remote_clock, remote_node):
         with self.lock:
-            for node, count in remote_increments.items():
-                self.increments[node] = max(self.increments[node], count)
-            self.counter = sum(self.increments.values())
-            for node, ts in remote_clock.items():
-                self.vector_clock[node] = max(self.vector_clock[node], ts)
+            self._apply_merge({'increments': remote_increments, 'clock': remote_clock})
             return self.counter, dict(self.vector_clock)
 
     def get(self):
         with self.lock:
             return self.counter, dict(self.increments), dict(self.vector_clock)
 
-    def _process(self, request):
-        cmd = request.get('cmd')
-
-        if cmd == 'get':
-            counter, increments, clock = self.get()
-            return {'ok': True, 'counter': counter, 'increments': increments, 'clock': clock}
-
-        if cmd == 'increment':
-            counter, clock = self.increment()
-            return {'ok': True, 'counter': counter, 'clock': clock}
-
-        if cmd == 'sync':
-            remote_increments = request.get('increments', {})
-            remote_clock = request['clock']
-            remote_node = request['node_id']
-            self.merge(remote_increments, remote_clock, remote_node)
-            counter, increments, clock = self.get()
-            return {'ok': True, 'counter': counter, 'increments': increments, 'clock': clock}
-
-        return super()._process(request)
-
 class PNCounterNode(GCounterNode):
     def __init__(self, node_id, host='localhost', port=12000):
         super().__init__(node_id, host, port)
         self.decrements = defaultdict(int)
+        self._dec_total = 0
 
-    def decrement(self):
-        with self.lock:
-            self.decrements[self.node_id] += 1
-            self.counter = sum(self.increments.values()) - sum(self.decrements.values())
-            self.vector_clock[self.node_id] += 1
-            return self.counter, dict(self.vector_clock)
+    def _apply_increment(self):
+        super()._apply_increment()
+        self.counter = self._inc_total - self._dec_total
+
+    def _apply_decrement(self):
+        self.decrements[self.node_id] += 1
+        self._dec_total += 1
+        self.counter = self._inc_total - self._dec_total
+        self.vector_clock[self.node_id] += 1
+
+    def _apply_merge(self, request):
+        self._inc_total += self._join(self.increments, request.get('increments', {}))
+        self._dec_total += self._join(self.decrements, request.get('decrements', {}))
+        self.counter = self._inc_total - self._dec_total
+        self._merge_clock(request['clock'])
+
+    def _state(self):
+        return {'ok': True, 'counter': self.counter, 'increments': self.increments, 'decrements': self.decrements, 'clock': self.vector_clock}
 
     def merge(self, remote_increments, remote_decrements, remote_clock, remote_node):
         with self.lock:
-            for node, count in remote_increments.items():
-                self.increments[node] = max(self.increments[node], count)
-            for node, count in remote_decrements.items():
-                self.decrements[node] = max(self.decrements[node], count)
-            self.counter = sum(self.increments.values()) - sum(self.decrements.values())
-            for node, ts in remote_clock.items():
-                self.vector_clock[node] = max(self.vector_clock[node], ts)
+            self._apply_merge({'increments': remote_increments, 'decrements': remote_decrements, 'clock': remote_clock})
             return self.counter, dict(self.vector_clock)
 
     def get(self):
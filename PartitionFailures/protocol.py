@@ -0,0 +1,72 @@
+import asyncio
+import socket
+import struct
+from codec import dumps, loads
+
+HEADER = struct.Struct('>I i')
+SOCKET_BUF = 4 << 20
+
+def tune_socket(sock):
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUF)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUF)
+    return sock
+
+def make_client_socket(host, port, timeout):
+    sock = tune_socket(socket.socket(socket.AF_INET, socket.SOCK_STREAM))
+    sock.settimeout(timeout)
+    try:
+        sock.connect((host, port))
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+def _recv_exact(sock, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    off = 0
+    while off < n:
+        got = sock.recv_into(view[off:])
+        if not got:
+            if not off:
+                return None
+            raise ConnectionError('connection closed mid-frame')
+        off += got
+    return buf
+
+def frame(payload, from_node=-1):
+    return HEADER.pack(len(payload), from_node) + payload
+
+def recv_frame(sock):
+    header = _recv_exact(sock, HEADER.size)
+    if header is None:
+        return -1, None
+    length, from_node = HEADER.unpack(header)
+    payload = _recv_exact(sock, length) if length else b''
+    if payload is None:
+        raise ConnectionError('connection closed mid-frame')
+    return from_node, payload
+
+def send_message(sock, message, from_node=-1):
+    sock.sendall(frame(dumps(message), from_node))
+
+def recv_message(sock):
+    _, payload = recv_frame(sock)
+    if payload is None:
+        raise ConnectionError('connection closed')
+    return loads(payload)
+
+async def read_frame(reader):
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise ConnectionError('connection closed mid-frame')
+        return -1, None
+    length, from_node = HEADER.unpack(header)
+    try:
+        payload = await reader.readexactly(length) if length else b''
+    except asyncio.IncompleteReadError:
+        raise ConnectionError('connection closed mid-frame')
+    return from_node, payload
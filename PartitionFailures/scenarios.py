@@ -1,21 +1,51 @@
 import socket
-import json
 import threading
 import time
 from node import PNCounterNode
 from network import NetworkSimulator, PartitionManager
+from codec import loads
+from protocol import recv_frame, send_message
 
-def send_request(host, port, request, timeout=2.0):
-    try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(timeout)
-        sock.connect((host, port))
-        sock.sendall(json.dumps(request).encode())
-        response = json.loads(sock.recv(65536).decode())
+_local = threading.local()
+
+def _connections():
+    conns = getattr(_local, 'conns', None)
+    if conns is None:
+        conns = _local.conns = {}
+    return conns
+
+def close_connections():
+    conns = _connections()
+    for sock in conns.values():
         sock.close()
-        return response
-    except Exception as e:
-        return {'ok': False, 'error': str(e)}
+    conns.clear()
+
+def send_request(host, port, request, timeout=2.0):
+    conns = _connections()
+    endpoint = (host, port)
+    while True:
+        sock = conns.pop(endpoint, None)
+        reused = sock is not None
+        stale = False
+        try:
+            if sock is None:
+                sock = socket.create_connection(endpoint, timeout=timeout)
+            sock.settimeout(timeout)
+            try:
+                send_message(sock, request)
+            except (BrokenPipeError, ConnectionResetError):
+                stale = True
+                raise
+            _, payload = recv_frame(sock)
+            if payload is None:
+                raise ConnectionError('connection closed')
+            conns[endpoint] = sock
+            return loads(payload)
+        except Exception as e:
+            if sock is not None:
+                sock.close()
+            if not (reused and stale):
+                return {'ok': False, 'error': str(e)}
 
 def get_counter(port):
     return send_request('localhost', port, {'cmd': 'get'})
@@ -81,6 +111,7 @@ def scenario_split_brain():
 
     for node in nodes:
         node.stop()
+    close_connections()
 
 def scenario_network_partition_counter():
     print('\n=== network partition with crdt counter ===')
@@ -131,6 +162,7 @@ def scenario_network_partition_counter():
 
     for node in nodes:
         node.stop()
+    close_connections()
 
 def scenario_quorum_loss():
     print('\n=== quorum loss scenario ===')
@@ -191,6 +223,7 @@ def scenario_quorum_loss():
     for node in nodes:
         if node.running:
             node.stop()
+    close_connections()
 
 def scenario_eventual_consistency():
     print('\n=== eventual consistency demonstration ===')
@@ -227,6 +260,7 @@ def scenario_eventual_consistency():
 
     for node in nodes:
         node.stop()
+    close_connections()
 
 if __name__ == '__main__':
     scenario_split_brain()
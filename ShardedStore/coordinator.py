@@ -1,7 +1,7 @@
 import socket
-import json
 import threading
 import time
+from protocol import make_client_socket, recv_message, send_message
 from router import ShardRouter
 from rebalancer import Rebalancer, ShardSplitter
 
@@ -19,6 +19,8 @@ class ClusterCoordinator:
     def initialize(self, initial_shards):
         with self.lock:
             self.shards = dict(initial_shards)
+            if self.router:
+                self.router.close()
             self.router = ShardRouter(dict(self.shards))
             self.rebalancer = Rebalancer(self.router)
             self.membership_version += 1
@@ -88,6 +90,8 @@ class ClusterCoordinator:
         self.running = False
         if hasattr(self, 'server_socket'):
             self.server_socket.close()
+        if self.router:
+            self.router.close()
 
     def _serve(self):
         while self.running:
@@ -99,12 +103,10 @@ class ClusterCoordinator:
 
     def _handle(self, conn):
         try:
-            data = conn.recv(65536)
-            if not data:
+            request = recv_message(conn)
+            if request is None:
                 return
-            request = json.loads(data.decode())
-            response = self._process(request)
-            conn.sendall(json.dumps(response).encode())
+            send_message(conn, self._process(request))
         finally:
             conn.close()
 
@@ -157,11 +159,9 @@ class CoordinatorClient:
 
     def _send(self, request):
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(self.timeout)
-            sock.connect((self.host, self.port))
-            sock.sendall(json.dumps(request).encode())
-            response = json.loads(sock.recv(1048576).decode())
+            sock = make_client_socket(self.host, self.port, self.timeout)
+            send_message(sock, request)
+            response = recv_message(sock)
             sock.close()
             return response
         except Exception as e:
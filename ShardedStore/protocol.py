@@ -0,0 +1,77 @@
+import asyncio
+import socket
+import struct
+import threading
+from codec import dumps, loads
+
+HEADER = struct.Struct('>I')
+SOCKET_BUF = 4 << 20
+RECV_BUF = 1 << 20
+
+_local = threading.local()
+
+def tune_socket(sock):
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUF)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUF)
+    return sock
+
+def make_client_socket(host, port, timeout):
+    sock = tune_socket(socket.socket(socket.AF_INET, socket.SOCK_STREAM))
+    sock.settimeout(timeout)
+    try:
+        sock.connect((host, port))
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+def _recv_buffer(n):
+    buf = getattr(_local, 'buf', None)
+    if buf is None or len(buf) < n:
+        buf = _local.buf = bytearray(max(n, RECV_BUF))
+    return memoryview(buf)[:n]
+
+def _recv_into(sock, view):
+    n = len(view)
+    off = 0
+    while off < n:
+        got = sock.recv_into(view[off:])
+        if not got:
+            if not off:
+                return False
+            raise ConnectionError('connection closed mid-frame')
+        off += got
+    return True
+
+def frame(payload):
+    return HEADER.pack(len(payload)) + payload
+
+def send_frame(sock, payload):
+    sock.sendall(frame(payload))
+
+def send_message(sock, message):
+    send_frame(sock, dumps(message))
+
+def recv_message(sock):
+    header = _recv_buffer(HEADER.size)
+    if not _recv_into(sock, header):
+        return None
+    length, = HEADER.unpack(header)
+    payload = _recv_buffer(length)
+    if length and not _recv_into(sock, payload):
+        raise ConnectionError('connection closed mid-frame')
+    return loads(payload)
+
+async def read_frame(reader):
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise ConnectionError('connection closed mid-frame')
+        return None
+    length, = HEADER.unpack(header)
+    try:
+        return await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        raise ConnectionError('connection closed mid-frame')
@@ -1,11 +1,14 @@
 import hashlib
 import bisect
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from shard import ShardClient
 
 class ConsistentHash:
     def __init__(self, nodes=None, replicas=150):
         self.replicas = replicas
         self.ring = []
+        self.ring_nodes = []
         self.node_map = {}
 
         if nodes:
@@ -13,22 +16,30 @@ class ConsistentHash:
                 self.add_node(node)
 
     def _hash(self, key):
-        return int(hashlib.md5(key.encode()).hexdigest(), 16)
+        return zlib.crc32(key.encode())
+
+    def _point(self, virtual_key):
+        return int.from_bytes(hashlib.md5(virtual_key.encode()).digest()[:4], 'big')
 
     def add_node(self, node):
         for i in range(self.replicas):
             virtual_key = f'{node}:{i}'
-            hash_val = self._hash(virtual_key)
-            bisect.insort(self.ring, hash_val)
+            hash_val = self._point(virtual_key)
+            idx = bisect.bisect_left(self.ring, hash_val)
+            self.ring.insert(idx, hash_val)
+            self.ring_nodes.insert(idx, node)
             self.node_map[hash_val] = node
 
     def remove_node(self, node):
+        removed = set()
         for i in range(self.replicas):
-            virtual_key = f'{node}:{i}'
-            hash_val = self._hash(virtual_key)
-            if hash_val in self.node_map:
-                self.ring.remove(hash_val)
+            hash_val = self._point(f'{node}:{i}')
+            if self.node_map.get(hash_val) == node:
                 del self.node_map[hash_val]
+                removed.add(hash_val)
+        if removed:
+            self.ring = [hash_val for hash_val in self.ring if hash_val not in removed]
+            self.ring_nodes = [self.node_map[hash_val] for hash_val in self.ring]
 
     def get_node(self, key):
         if not self.ring:
@@ -40,7 +51,22 @@ class ConsistentHash:
         if idx == len(self.ring):
             idx = 0
 
-        return self.node_map[self.ring[idx]]
+        return self.ring_nodes[idx]
+
+    def get_nodes_batch(self, keys):
+        ring = self.ring
+        if not ring:
+            return [None] * len(keys)
+
+        ring_nodes = self.ring_nodes
+        crc32 = zlib.crc32
+        bisect_right = bisect.bisect_right
+        n = len(ring)
+        nodes = []
+        for key in keys:
+            idx = bisect_right(ring, crc32(key.encode()))
+            nodes.append(ring_nodes[idx if idx < n else 0])
+        return nodes
 
     def get_nodes(self, key, count=1):
         if not self.ring:
@@ -49,13 +75,13 @@ class ConsistentHash:
         hash_val = self._hash(key)
         idx = bisect.bisect_right(self.ring, hash_val)
 
+        ring_nodes = self.ring_nodes
+        n = len(ring_nodes)
         nodes = []
         seen = set()
 
-        for i in range(len(self.ring)):
-            ring_idx = (idx + i) % len(self.ring)
-            node = self.node_map[self.ring[ring_idx]]
-
+        for i in range(idx, idx + n):
+            node = ring_nodes[i - n if i >= n else i]
             if node not in seen:
                 seen.add(node)
                 nodes.append(node)
@@ -70,6 +96,8 @@ class ShardRouter:
         self.shard_addrs = shard_addrs
         self.hash_ring = ConsistentHash()
         self.clients = {}
+        self._pool_size = max(1, len(shard_addrs))
+        self._executor = ThreadPoolExecutor(max_workers=self._pool_size)
 
         for shard_id, (host, port) in shard_addrs.items():
             node_key = f'{shard_id}'
@@ -99,38 +127,49 @@ class ShardRouter:
         return {'ok': False, 'error': 'no shard available'}
 
     def multi_get(self, keys):
+        keys = list(keys)
         key_groups = {}
-        for key in keys:
-            node_key = self.hash_ring.get_node(key)
-            if node_key not in key_groups:
-                key_groups[node_key] = []
-            key_groups[node_key].append(key)
-
-        results = {}
+        for key, node_key in zip(keys, self.hash_ring.get_nodes_batch(keys)):
+            group = key_groups.get(node_key)
+            if group is None:
+                group = key_groups[node_key] = []
+            group.append(key)
+
+        submit = self._executor.submit
+        futures = []
         for node_key, group_keys in key_groups.items():
             client = self.clients.get(node_key)
             if client:
-                response = client.bulk_get(group_keys)
-                if response.get('ok'):
-                    results.update(response.get('data', {}))
+                futures.append(submit(client.bulk_get, group_keys))
+
+        results = {}
+        for future in futures:
+            response = future.result()
+            if response.get('ok'):
+                results.update(response.get('data', {}))
 
         return results
 
     def multi_put(self, items):
         key_groups = {}
-        for key, value in items.items():
-            node_key = self.hash_ring.get_node(key)
-            if node_key not in key_groups:
-                key_groups[node_key] = {}
-            key_groups[node_key][key] = value
-
-        total = 0
+        for (key, value), node_key in zip(items.items(), self.hash_ring.get_nodes_batch(list(items))):
+            group = key_groups.get(node_key)
+            if group is None:
+                group = key_groups[node_key] = {}
+            group[key] = value
+
+        submit = self._executor.submit
+        futures = []
         for node_key, group_items in key_groups.items():
             client = self.clients.get(node_key)
             if client:
-                response = client.bulk_put(group_items)
-                if response.get('ok'):
-                    total += response.get('count', 0)
+                futures.append(submit(client.bulk_put, group_items))
+
+        total = 0
+        for future in futures:
+            response = future.result()
+            if response.get('ok'):
+                total += response.get('count', 0)
 
         return {'ok': True, 'count': total}
 
@@ -147,6 +186,11 @@ class ShardRouter:
         self.shard_addrs[shard_id] = (host, port)
         self.hash_ring.add_node(node_key)
         self.clients[node_key] = ShardClient(host, port)
+        if len(self.clients) > self._pool_size:
+            old = self._executor
+            self._pool_size = len(self.clients)
+            self._executor = ThreadPoolExecutor(max_workers=self._pool_size)
+            old.shutdown(wait=False)
 
     def remove_shard(self, shard_id):
         node_key = f'{shard_id}'
@@ -154,6 +198,9 @@ class ShardRouter:
         self.clients.pop(node_key, None)
         self.shard_addrs.pop(shard_id, None)
 
+    def close(self):
+        self._executor.shutdown()
+
 class RangeRouter:
     def __init__(self, shard_addrs, key_ranges):
         self.shard_addrs = shard_addrs
@@ -188,13 +235,9 @@ class RangeRouter:
                 continue
             client = self.clients.get(shard_id)
             if client:
-                response = client.keys()
+                response = client.range(start_key, end_key)
                 if response.get('ok'):
-                    for k in response.get('keys', []):
-                        if start_key <= k < end_key:
-                            val = client.get(k)
-                            if val.get('ok'):
-                                results[k] = val.get('value')
+                    results.update(response.get('data', {}))
         return results
 
 
@@ -1,9 +1,17 @@
+import asyncio
+import queue
 import socket
 import struct
 import threading
-import json
+import os
 import time
 from pathlib import Path
+from codec import dumps, loads
+from protocol import frame, make_client_socket, read_frame, recv_message, send_frame, tune_socket
+
+RECORD = struct.Struct('>IIB')
+SNAPSHOT_EVERY = 10000
+LOCK_BUCKETS = 64
 
 class ShardStorage:
     def __init__(self, shard_id, data_dir='shard_data'):
@@ -11,44 +19,100 @@ class ShardStorage:
         self.data_dir = Path(data_dir) / f'shard_{shard_id}'
         self.data_dir.mkdir(parents=True, exist_ok=True)
         self.data_file = self.data_dir / 'data.json'
+        self.wal_file = self.data_dir / 'data.wal'
+        self.old_wal_file = self.data_dir / 'data.wal.1'
         self.data = {}
         self.lock = threading.Lock()
+        self._locks = [threading.Lock() for _ in range(LOCK_BUCKETS)]
+        self.writes = 0
+        self.snapshotting = False
         self._load()
+        self.wal = open(self.wal_file, 'ab', buffering=0)
 
     def _load(self):
         if self.data_file.exists():
-            with open(self.data_file) as f:
-                self.data = json.load(f)
-
-    def _save(self):
-        with open(self.data_file, 'w') as f:
-            json.dump(self.data, f)
+            self.data = loads(self.data_file.read_bytes())
+        self._replay(self.old_wal_file)
+        self._replay(self.wal_file)
+
+    def _replay(self, path):
+        if not path.exists():
+            return
+        buf = path.read_bytes()
+        offset = 0
+        while offset + RECORD.size <= len(buf):
+            key_len, value_len, deleted = RECORD.unpack_from(buf, offset)
+            start = offset + RECORD.size
+            end = start + key_len + value_len
+            if end > len(buf):
+                break
+            key = buf[start:start + key_len].decode()
+            if deleted:
+                self.data.pop(key, None)
+            else:
+                self.data[key] = loads(buf[start + key_len:end])
+            offset = end
+        if offset < len(buf):
+            os.truncate(path, offset)
+
+    def _append(self, key, value_bytes, deleted):
+        key_bytes = key.encode()
+        self.wal.write(RECORD.pack(len(key_bytes), len(value_bytes), deleted) + key_bytes + value_bytes)
+        self.writes += 1
+
+    def _maybe_snapshot(self):
+        if self.writes < SNAPSHOT_EVERY or self.snapshotting:
+            return
+        with self.lock:
+            if self.writes < SNAPSHOT_EVERY or self.snapshotting:
+                return
+            for lock in self._locks:
+                lock.acquire()
+            try:
+                self.snapshotting = True
+                self.writes = 0
+                self.wal.close()
+                os.replace(self.wal_file, self.old_wal_file)
+                self.wal = open(self.wal_file, 'ab', buffering=0)
+                data = dict(self.data)
+            finally:
+                for lock in self._locks:
+                    lock.release()
+        threading.Thread(target=self._snapshot, args=(data,), daemon=True).start()
+
+    def _snapshot(self, data):
+        tmp = self.data_file.with_suffix('.tmp')
+        tmp.write_bytes(dumps(data))
+        os.replace(tmp, self.data_file)
+        self.old_wal_file.unlink()
+        self.snapshotting = False
 
     def put(self, key, value):
-        with self.lock:
+        value_bytes = dumps(value)
+        with self._locks[hash(key) & (LOCK_BUCKETS - 1)]:
+            self._append(key, value_bytes, 0)
             self.data[key] = value
-            self._save()
-
-    def get(self, key):
-        with self.lock:
-            return self.data.get(key)
+        self._maybe_snapshot()
 
     def delete(self, key):
-        with self.lock:
+        with self._locks[hash(key) & (LOCK_BUCKETS - 1)]:
+            if key not in self.data:
+                return
+            self._append(key, b'', 1)
             self.data.pop(key, None)
-            self._save()
+        self._maybe_snapshot()
+
+    def get(self, key):
+        return self.data.get(key)
 
     def keys(self):
-        with self.lock:
-            return list(self.data.keys())
+        return list(self.data)
 
     def items(self):
-        with self.lock:
-            return list(self.data.items())
+        return list(self.data.items())
 
     def size(self):
-        with self.lock:
-            return len(self.data)
+        return len(self.data)
 
 class ShardServer:
     def __init__(self, shard_id, host='localhost', port=10000, data_dir='shard_data'):
@@ -59,6 +123,8 @@ class ShardServer:
         self.running = False
         self.server_socket = None
         self.server_thread = None
+        self.loop = None
+        self.conns = set()
         self.stats = {'gets': 0, 'puts': 0, 'deletes': 0}
 
     def start(self):
@@ -66,33 +132,50 @@ class ShardServer:
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_socket.bind((self.host, self.port))
-        self.server_socket.listen(10)
+        self.server_socket.listen(128)
+        self.loop = asyncio.new_event_loop()
+        self._stopped = asyncio.Event()
         self.server_thread = threading.Thread(target=self._serve, daemon=True)
         self.server_thread.start()
 
     def stop(self):
         self.running = False
-        if self.server_socket:
-            self.server_socket.close()
+        if self.loop and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._stopped.set)
+            if self.server_thread is not threading.current_thread():
+                self.server_thread.join(timeout=5.0)
 
     def _serve(self):
-        while self.running:
-            try:
-                conn, addr = self.server_socket.accept()
-                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
-            except:
-                break
-
-    def _handle(self, conn):
+        asyncio.set_event_loop(self.loop)
         try:
-            data = conn.recv(65536)
-            if not data:
-                return
-            request = json.loads(data.decode())
-            response = self._process(request)
-            conn.sendall(json.dumps(response).encode())
+            self.loop.run_until_complete(self._main())
         finally:
-            conn.close()
+            self.loop.close()
+
+    async def _main(self):
+        server = await asyncio.start_server(self._handle, sock=self.server_socket)
+        async with server:
+            await self._stopped.wait()
+        for writer in list(self.conns):
+            writer.close()
+        pending = asyncio.all_tasks() - {asyncio.current_task()}
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _handle(self, reader, writer):
+        tune_socket(writer.get_extra_info('socket'))
+        self.conns.add(writer)
+        try:
+            while self.running:
+                payload = await read_frame(reader)
+                if payload is None:
+                    return
+                writer.write(frame(dumps(self._process(loads(payload)))))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.conns.discard(writer)
+            writer.close()
 
     def _process(self, request):
         cmd = request.get('cmd')
@@ -124,6 +207,11 @@ class ShardServer:
                     result[k] = v
             return {'ok': True, 'data': result}
 
+        if cmd == 'range':
+            start_key, end_key = request['start'], request['end']
+            result = {k: v for k, v in self.storage.items() if start_key <= k < end_key}
+            return {'ok': True, 'data': result}
+
         if cmd == 'bulk_put':
             items = request.get('items', {})
             for k, v in items.items():
@@ -155,32 +243,86 @@ class ShardServer:
 
         return {'ok': False, 'error': 'unknown command'}
 
+class SocketPool:
+    def __init__(self):
+        self.idle = {}
+        self._pool_creation_lock = threading.Lock()
+
+    def _queue(self, addr):
+        idle = self.idle.get(addr)
+        if idle is None:
+            with self._pool_creation_lock:
+                idle = self.idle.get(addr)
+                if idle is None:
+                    idle = self.idle[addr] = queue.SimpleQueue()
+        return idle
+
+    def connect(self, addr, timeout):
+        return make_client_socket(*addr, timeout)
+
+    def acquire(self, addr, timeout):
+        try:
+            sock = self._queue(addr).get_nowait()
+        except queue.Empty:
+            return self.connect(addr, timeout), False
+        sock.settimeout(timeout)
+        return sock, True
+
+    def release(self, addr, sock):
+        self._queue(addr).put(sock)
+
+_pool = SocketPool()
+
 class ShardClient:
-    def __init__(self, host, port, timeout=5.0):
+    _GET_PREFIX = b'{"cmd":"get","key":'
+    _PUT_PREFIX = b'{"cmd":"put","key":'
+    _DELETE_PREFIX = b'{"cmd":"delete","key":'
+    _VALUE_SEP = b',"value":'
+
+    def __init__(self, host, port, timeout=5.0, pool=None):
         self.host = host
         self.port = port
         self.timeout = timeout
+        self.pool = pool or _pool
+
+    def _exchange(self, sock, payload):
+        send_frame(sock, payload)
+        response = recv_message(sock)
+        if response is None:
+            raise ConnectionError('connection closed')
+        return response
 
     def _send(self, request):
+        return self._send_payload(dumps(request))
+
+    def _send_payload(self, payload):
+        addr = (self.host, self.port)
+        sock = None
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(self.timeout)
-            sock.connect((self.host, self.port))
-            sock.sendall(json.dumps(request).encode())
-            response = json.loads(sock.recv(1048576).decode())
-            sock.close()
+            sock, reused = self.pool.acquire(addr, self.timeout)
+            try:
+                response = self._exchange(sock, payload)
+            except ConnectionError:
+                if not reused:
+                    raise
+                sock.close()
+                sock = self.pool.connect(addr, self.timeout)
+                response = self._exchange(sock, payload)
+            self.pool.release(addr, sock)
             return response
         except Exception as e:
+            if sock:
+                sock.close()
             return {'ok': False, 'error': str(e)}
 
     def get(self, key):
-        return self._send({'cmd': 'get', 'key': key})
+        return self._send_payload(self._GET_PREFIX + dumps(key) + b'}')
 
     def put(self, key, value):
-        return self._send({'cmd': 'put', 'key': key, 'value': value})
+        return self._send_payload(self._PUT_PREFIX + dumps(key) + self._VALUE_SEP + dumps(value) + b'}')
 
     def delete(self, key):
-        return self._send({'cmd': 'delete', 'key': key})
+        return self._send_payload(self._DELETE_PREFIX + dumps(key) + b'}')
 
     def keys(self):
         return self._send({'cmd': 'keys'})
@@ -188,6 +330,9 @@ class ShardClient:
     def bulk_get(self, keys):
         return self._send({'cmd': 'bulk_get', 'keys': keys})
 
+    def range(self, start_key, end_key):
+        return self._send({'cmd': 'range', 'start': start_key, 'end': end_key})
+
     def bulk_put(self, items):
         return self._send({'cmd': 'bulk_put', 'items': items})
 
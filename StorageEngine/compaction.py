@@ -47,6 +47,7 @@ class Compactor:
 
         for key in sorted(merged_records.keys()):
             new_segment.append(key, merged_records[key])
+        new_segment.seal()
 
         final_path = self.log_store.data_dir / f'segment_{new_segment_id:06d}.log'
         new_path.rename(final_path)
@@ -125,6 +126,7 @@ class LeveledCompactor:
 
             for key in sorted(records.keys()):
                 new_segment.append(key, records[key])
+            new_segment.seal()
 
             self.levels[level + 1].append(new_segment)
 
@@ -27,20 +27,7 @@ class StorageEngine:
         if not self.bloom.might_contain(key):
             return None
 
-        location = self.index.get(key)
-        if location is None:
-            return None
-
-        segment_id, offset = location
-        segment = self.log_store.get_segment(segment_id)
-        if segment is None:
-            return None
-
-        key_read, value, deleted = segment.read_at(offset)
-        if deleted or key_read != key:
-            return None
-
-        return value
+        return self.log_store.get(key)
 
     def delete(self, key):
         with self.lock:
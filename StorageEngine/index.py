@@ -26,13 +26,7 @@ class HashIndex:
 
     def rebuild(self, log_store):
         with self.lock:
-            self.index.clear()
-            for segment in log_store.segments:
-                for offset, key, value, deleted in segment.iterate():
-                    if deleted:
-                        self.index.pop(key, None)
-                    else:
-                        self.index[key] = (segment.segment_id, offset)
+            self.index = dict(log_store.index)
 
 class SparseIndex:
     def __init__(self, interval=100):
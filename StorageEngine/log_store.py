@@ -1,3 +1,4 @@
+import mmap
 import os
 import struct
 import threading
@@ -5,15 +6,19 @@ import time
 from pathlib import Path
 
 SEGMENT_MAX_SIZE = 1024 * 1024
+HEADER = struct.Struct('>I I B')
+_fdatasync = getattr(os, 'fdatasync', os.fsync)
 
 class LogSegment:
-    def __init__(self, path, segment_id):
+    def __init__(self, path, segment_id, new=False):
         self.path = Path(path)
         self.segment_id = segment_id
         self.size = 0
         self.lock = threading.Lock()
+        self._mm = None
+        self._wf = None
 
-        if self.path.exists():
+        if not new and self.path.exists():
             self.size = self.path.stat().st_size
 
     def append(self, key, value):
@@ -26,27 +31,52 @@ class LogSegment:
             record = header + key_bytes + value_bytes
 
             offset = self.size
-            with open(self.path, 'ab') as f:
-                f.write(record)
+            if self._wf is None:
+                self._wf = open(self.path, 'ab', buffering=0)
+            self._wf.write(record)
 
             self.size += len(record)
             return offset
 
+    def sync(self):
+        with self.lock:
+            if self._wf is None:
+                return
+            fd = os.dup(self._wf.fileno())
+        try:
+            _fdatasync(fd)
+        finally:
+            os.close(fd)
+
+    def seal(self):
+        with self.lock:
+            if self._wf is not None:
+                _fdatasync(self._wf.fileno())
+                self._wf.close()
+                self._wf = None
+
+    def _map(self):
+        mm = self._mm
+        if mm is None or len(mm) < self.size:
+            with open(self.path, 'rb') as f:
+                mm = self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return mm
+
     def read_at(self, offset):
-        with open(self.path, 'rb') as f:
-            f.seek(offset)
-            header = f.read(9)
-            if len(header) < 9:
-                return None, None, False
+        if offset + HEADER.size > self.size:
+            return None, None, False
 
-            key_len, value_len, deleted = struct.unpack('>I I B', header)
-            key = f.read(key_len).decode('utf-8')
+        mm = self._map()
+        key_len, value_len, deleted = HEADER.unpack_from(mm, offset)
+        start = offset + HEADER.size
+        key = mm[start:start + key_len].decode('utf-8')
 
-            if deleted:
-                return key, None, True
+        if deleted:
+            return key, None, True
 
-            value = f.read(value_len).decode('utf-8')
-            return key, value, False
+        start += key_len
+        value = mm[start:start + value_len].decode('utf-8')
+        return key, value, False
 
     def iterate(self):
         if not self.path.exists():
@@ -79,7 +109,12 @@ class LogStore:
         self.data_dir.mkdir(parents=True, exist_ok=True)
         self.segments = []
         self.active_segment = None
+        self.index = {}
         self.lock = threading.Lock()
+        self.commit_cond = threading.Condition()
+        self.appended = 0
+        self.committed = 0
+        self.syncing = False
         self._load_segments()
 
     def _load_segments(self):
@@ -88,29 +123,83 @@ class LogStore:
             segment_id = int(path.stem.split('_')[1])
             segment = LogSegment(path, segment_id)
             self.segments.append(segment)
+            self._index_segment(segment)
 
         if not self.segments:
             self._create_new_segment()
         else:
             self.active_segment = self.segments[-1]
 
+    def _index_segment(self, segment):
+        index = self.index
+        for offset, key, value, deleted in segment.iterate():
+            if deleted:
+                index.pop(key, None)
+            else:
+                index[key] = (segment.segment_id, offset)
+
     def _create_new_segment(self):
-        segment_id = len(self.segments)
+        if self.active_segment is not None:
+            self.active_segment.seal()
+        segment_id = max((s.segment_id for s in self.segments), default=-1) + 1
         path = self.data_dir / f'segment_{segment_id:06d}.log'
-        segment = LogSegment(path, segment_id)
+        segment = LogSegment(path, segment_id, new=True)
         self.segments.append(segment)
         self.active_segment = segment
         return segment
 
-    def put(self, key, value):
+    def put(self, key, value, sync=False):
         with self.lock:
             if self.active_segment.is_full():
                 self._create_new_segment()
+            segment_id = self.active_segment.segment_id
             offset = self.active_segment.append(key, value)
-            return (self.active_segment.segment_id, offset)
-
-    def delete(self, key):
-        return self.put(key, None)
+            if value is None:
+                self.index.pop(key, None)
+            else:
+                self.index[key] = (segment_id, offset)
+            self.appended += 1
+            seq = self.appended
+        if sync:
+            self.commit(seq)
+        return (segment_id, offset)
+
+    def commit(self, seq=None):
+        cond = self.commit_cond
+        with cond:
+            if seq is None:
+                seq = self.appended
+            while self.committed < seq:
+                if self.syncing:
+                    cond.wait()
+                    continue
+                self.syncing = True
+                target = self.appended
+                segment = self.active_segment
+                cond.release()
+                try:
+                    segment.sync()
+                finally:
+                    cond.acquire()
+                    self.syncing = False
+                    cond.notify_all()
+                self.committed = max(self.committed, target)
+
+    def get(self, key):
+        with self.lock:
+            location = self.index.get(key)
+            if location is None:
+                return None
+            segment = self.get_segment(location[0])
+            if segment is None:
+                return None
+            key_read, value, deleted = segment.read_at(location[1])
+        if deleted or key_read != key:
+            return None
+        return value
+
+    def delete(self, key, sync=False):
+        return self.put(key, None, sync)
 
     def get_all_records(self):
         records = {}
@@ -145,8 +234,13 @@ class LogStore:
 
             self.segments.insert(insert_pos, new_segment)
 
+            for offset, key, value, deleted in new_segment.iterate():
+                location = self.index.get(key)
+                if location is not None and location[0] in old_ids:
+                    self.index[key] = (new_segment.segment_id, offset)
+
             for old_segment in old_segments:
-                if old_segment.path.exists():
+                if old_segment.path != new_segment.path and old_segment.path.exists():
                     old_segment.path.unlink()
 
 
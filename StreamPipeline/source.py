@@ -1,22 +1,24 @@
 import time
-import json
 import threading
 import random
 from dataclasses import dataclass
+from operator import itemgetter
 from typing import Iterator, Callable, Optional
-from queue import Queue
+from collections import deque
+from codec import loads
 
-@dataclass
+GENERATOR_BATCH_SIZE = 1024
+SOCKET_BUFFER_SIZE = 1 << 20
+
+_EVENT_FIELDS = itemgetter('key', 'value', 'event_time')
+
+@dataclass(slots=True)
 class Event:
     key: str
     value: any
     event_time: float
     processing_time: float = None
 
-    def __post_init__(self):
-        if self.processing_time is None:
-            self.processing_time = time.time()
-
     def to_dict(self):
         return {
             'key': self.key,
@@ -27,15 +29,16 @@ class Event:
 
     @classmethod
     def from_dict(cls, d):
-        return cls(d['key'], d['value'], d['event_time'], d.get('processing_time'))
+        key, value, event_time = _EVENT_FIELDS(d)
+        return cls(key, value, event_time, d.get('processing_time'))
 
 class EventSource:
     def __init__(self):
         self.running = False
-        self.subscribers = []
+        self.subscribers = ()
 
     def subscribe(self, callback: Callable[[Event], None]):
-        self.subscribers.append(callback)
+        self.subscribers = self.subscribers + (callback,)
 
     def emit(self, event: Event):
         for callback in self.subscribers:
@@ -76,8 +79,7 @@ class FileSource(EventSource):
 
     def _default_parse(self, line: str) -> Optional[Event]:
         try:
-            data = json.loads(line)
-            return Event.from_dict(data)
+            return Event.from_dict(loads(line))
         except:
             return None
 
@@ -118,8 +120,7 @@ class SocketSource(EventSource):
 
     def _default_parse(self, data: bytes) -> Optional[Event]:
         try:
-            d = json.loads(data.decode())
-            return Event.from_dict(d)
+            return Event.from_dict(loads(data))
         except:
             return None
 
@@ -137,30 +138,45 @@ class SocketSource(EventSource):
             self.socket.close()
 
     def _run(self):
-        buffer = b''
+        buffer = bytearray(SOCKET_BUFFER_SIZE)
+        view = memoryview(buffer)
+        start = end = 0
         while self.running:
             try:
-                data = self.socket.recv(4096)
-                if not data:
+                if end == len(buffer):
+                    view.release()
+                    buffer.extend(bytes(len(buffer)))
+                    view = memoryview(buffer)
+
+                n = self.socket.recv_into(view[end:])
+                if not n:
                     break
+                end += n
 
-                buffer += data
-                while b'\n' in buffer:
-                    line, buffer = buffer.split(b'\n', 1)
-                    event = self.parse_func(line)
+                while (newline := buffer.find(b'\n', start, end)) != -1:
+                    event = self.parse_func(bytes(view[start:newline]))
+                    start = newline + 1
                     if event:
+                        event.processing_time = time.time()
                         self.emit(event)
+
+                if start:
+                    view[:end - start] = view[start:end]
+                    end -= start
+                    start = 0
             except:
                 break
 
 class QueueSource(EventSource):
     def __init__(self):
         super().__init__()
-        self.queue = Queue()
+        self.queue = deque()
+        self._ready = threading.Event()
         self.thread = None
 
     def put(self, event: Event):
-        self.queue.put(event)
+        self.queue.append(event)
+        self._ready.set()
 
     def start(self):
         super().start()
@@ -170,7 +186,16 @@ class QueueSource(EventSource):
     def _run(self):
         while self.running:
             try:
-                event = self.queue.get(timeout=0.1)
+                event = self.queue.popleft()
+            except IndexError:
+                self._ready.clear()
+                if not self.queue:
+                    self._ready.wait(0.1)
+                continue
+
+            if event.processing_time is None:
+                event.processing_time = time.time()
+            try:
                 self.emit(event)
             except:
                 continue
@@ -178,47 +203,61 @@ class QueueSource(EventSource):
 def click_stream_generator() -> Iterator[Event]:
     users = ['user_1', 'user_2', 'user_3', 'user_4', 'user_5']
     pages = ['/home', '/products', '/cart', '/checkout', '/profile']
+    durations = range(1, 61)
 
     while True:
-        user = random.choice(users)
-        page = random.choice(pages)
-        event_time = time.time() - random.uniform(0, 5)
-
-        yield Event(
-            key=user,
-            value={'page': page, 'duration': random.randint(1, 60)},
-            event_time=event_time
+        batch = zip(
+            random.choices(users, k=GENERATOR_BATCH_SIZE),
+            random.choices(pages, k=GENERATOR_BATCH_SIZE),
+            random.choices(durations, k=GENERATOR_BATCH_SIZE)
         )
+        for user, page, duration in batch:
+            now = time.time()
+            yield Event(
+                key=user,
+                value={'page': page, 'duration': duration},
+                event_time=now - 5 * random.random(),
+                processing_time=now
+            )
 
 def sensor_data_generator(num_sensors: int = 10) -> Iterator[Event]:
+    sensors = [f'sensor_{i}' for i in range(num_sensors)]
+    gauss = random.gauss
+
     while True:
-        sensor_id = f'sensor_{random.randint(0, num_sensors - 1)}'
-        event_time = time.time() - random.uniform(0, 2)
-
-        yield Event(
-            key=sensor_id,
-            value={
-                'temperature': round(20 + random.gauss(0, 5), 2),
-                'humidity': round(50 + random.gauss(0, 10), 2)
-            },
-            event_time=event_time
+        batch = zip(
+            random.choices(sensors, k=GENERATOR_BATCH_SIZE),
+            [round(20 + gauss(0, 5), 2) for _ in range(GENERATOR_BATCH_SIZE)],
+            [round(50 + gauss(0, 10), 2) for _ in range(GENERATOR_BATCH_SIZE)]
         )
+        for sensor_id, temperature, humidity in batch:
+            now = time.time()
+            yield Event(
+                key=sensor_id,
+                value={'temperature': temperature, 'humidity': humidity},
+                event_time=now - 2 * random.random(),
+                processing_time=now
+            )
 
 def transaction_generator() -> Iterator[Event]:
     accounts = [f'account_{i}' for i in range(100)]
+    types = ['deposit', 'withdrawal', 'transfer']
+    rand = random.random
 
     while True:
-        account = random.choice(accounts)
-        event_time = time.time() - random.uniform(0, 3)
-
-        yield Event(
-            key=account,
-            value={
-                'type': random.choice(['deposit', 'withdrawal', 'transfer']),
-                'amount': round(random.uniform(10, 1000), 2)
-            },
-            event_time=event_time
+        batch = zip(
+            random.choices(accounts, k=GENERATOR_BATCH_SIZE),
+            random.choices(types, k=GENERATOR_BATCH_SIZE),
+            [round(10 + 990 * rand(), 2) for _ in range(GENERATOR_BATCH_SIZE)]
         )
+        for account, kind, amount in batch:
+            now = time.time()
+            yield Event(
+                key=account,
+                value={'type': kind, 'amount': amount},
+                event_time=now - 3 * rand(),
+                processing_time=now
+            )
 
 if __name__ == '__main__':
     source = GeneratorSource(click_stream_generator, interval=0.5)
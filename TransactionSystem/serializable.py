@@ -1,5 +1,4 @@
 import threading
-import time
 from collections import defaultdict
 from dataclasses import dataclass, field
 from typing import Set, Dict, Optional
@@ -8,8 +7,8 @@ from store import MVCCStore
 @dataclass
 class SSITransaction:
     txn_id: int
-    start_ts: float
-    commit_ts: Optional[float] = None
+    start_ts: int
+    commit_ts: Optional[int] = None
     read_set: Set[str] = field(default_factory=set)
     write_set: Dict[str, any] = field(default_factory=dict)
     in_conflict: Set[int] = field(default_factory=set)
@@ -31,7 +30,7 @@ class SerializableSnapshotIsolation:
         with self.lock:
             txn_id = self.next_txn_id
             self.next_txn_id += 1
-            txn = SSITransaction(txn_id=txn_id, start_ts=time.time())
+            txn = SSITransaction(txn_id=txn_id, start_ts=self.store._next_ts())
             self.transactions[txn_id] = txn
             self.store.active_txns[txn_id] = {
                 'start_ts': txn.start_ts,
@@ -96,7 +95,7 @@ class SerializableSnapshotIsolation:
                 self._abort_internal(txn)
                 return False, 'serialization failure'
 
-            txn.commit_ts = time.time()
+            txn.commit_ts = self.store._next_ts()
             success, error = self.store.commit(txn_id)
 
             if success:
@@ -1,22 +1,33 @@
 import threading
-import time
 from collections import defaultdict
-from dataclasses import dataclass, field
-from typing import Optional, Any, List, Dict
+from dataclasses import dataclass
+from typing import Optional, Any, Dict, NamedTuple
 
-@dataclass
-class Version:
+class Version(NamedTuple):
     value: Any
     txn_id: int
-    timestamp: float
+    timestamp: int
     deleted: bool = False
 
+class VersionNode:
+    __slots__ = ('version', 'next')
+
+    def __init__(self, version, next=None):
+        self.version = version
+        self.next = next
+
 @dataclass
 class MVCCRecord:
-    versions: List[Version] = field(default_factory=list)
+    head: Optional[VersionNode] = None
     lock_holder: Optional[int] = None
     lock_mode: Optional[str] = None
 
+    def newest_first(self):
+        node = self.head
+        while node is not None:
+            yield node.version
+            node = node.next
+
 class MVCCStore:
     def __init__(self):
         self.data: Dict[str, MVCCRecord] = defaultdict(MVCCRecord)
@@ -24,36 +35,47 @@ class MVCCStore:
         self.next_txn_id = 1
         self.active_txns = {}
         self.committed_txns = {}
+        self._clock = 0
+        self._clock_lock = threading.Lock()
+
+    def _next_ts(self):
+        with self._clock_lock:
+            self._clock += 1
+            return self._clock
 
     def begin_transaction(self):
         with self.lock:
             txn_id = self.next_txn_id
             self.next_txn_id += 1
-            snapshot_ts = time.time()
+            snapshot_ts = self._next_ts()
             self.active_txns[txn_id] = {
                 'start_ts': snapshot_ts,
                 'read_set': set(),
                 'write_set': {},
+                'read_cache': {},
                 'status': 'active'
             }
             return txn_id
 
     def _get_visible_version(self, key, txn_id):
         record = self.data.get(key)
-        if not record or not record.versions:
+        if not record or record.head is None:
             return None
 
         txn_info = self.active_txns.get(txn_id)
-        snapshot_ts = txn_info['start_ts'] if txn_info else time.time()
+        snapshot_ts = txn_info['start_ts'] if txn_info else self._clock
+        committed_get = self.committed_txns.get
 
-        for version in reversed(record.versions):
-            if version.txn_id == txn_id:
-                return None if version.deleted else version.value
+        node = record.head
+        while node is not None:
+            value, version_txn, _, deleted = node.version
+            if version_txn == txn_id:
+                return None if deleted else value
 
-            if version.txn_id in self.committed_txns:
-                commit_ts = self.committed_txns[version.txn_id]
-                if commit_ts <= snapshot_ts:
-                    return None if version.deleted else version.value
+            commit_ts = committed_get(version_txn)
+            if commit_ts is not None and commit_ts <= snapshot_ts:
+                return None if deleted else value
+            node = node.next
 
         return None
 
@@ -116,7 +138,7 @@ class MVCCStore:
                 return False, 'transaction not active'
 
             txn_info = self.active_txns[txn_id]
-            commit_ts = time.time()
+            commit_ts = self._next_ts()
 
             for key, pending in txn_info['write_set'].items():
                 record = self.data[key]
@@ -126,7 +148,7 @@ class MVCCStore:
                     timestamp=commit_ts,
                     deleted=pending['deleted']
                 )
-                record.versions.append(version)
+                record.head = VersionNode(version, record.head)
                 record.lock_holder = None
                 record.lock_mode = None
 
@@ -154,17 +176,21 @@ class MVCCStore:
         with self.lock:
             for key, record in self.data.items():
                 visible = []
-                for version in record.versions:
+                total = 0
+                for version in record.newest_first():
+                    total += 1
                     if version.txn_id in self.committed_txns:
                         if self.committed_txns[version.txn_id] >= before_ts:
                             visible.append(version)
                     else:
                         visible.append(version)
-                if len(visible) < len(record.versions):
-                    if visible:
-                        record.versions = visible
-                    else:
-                        record.versions = record.versions[-1:]
+                if len(visible) < total:
+                    if not visible:
+                        visible = [record.head.version]
+                    head = None
+                    for version in reversed(visible):
+                        head = VersionNode(version, head)
+                    record.head = head
 
 class ReadUncommittedStore(MVCCStore):
     def read(self, txn_id, key):
@@ -173,10 +199,10 @@ class ReadUncommittedStore(MVCCStore):
                 return None, 'transaction not active'
 
             record = self.data.get(key)
-            if not record or not record.versions:
+            if not record or record.head is None:
                 return None, None
 
-            latest = record.versions[-1]
+            latest = record.head.version
             return None if latest.deleted else latest.value, None
 
 class ReadCommittedStore(MVCCStore):
@@ -192,16 +218,33 @@ class ReadCommittedStore(MVCCStore):
                 return (None if pending['deleted'] else pending['value']), None
 
             record = self.data.get(key)
-            if not record or not record.versions:
+            if not record or record.head is None:
                 return None, None
 
-            for version in reversed(record.versions):
+            for version in record.newest_first():
                 if version.txn_id in self.committed_txns:
                     return None if version.deleted else version.value, None
 
             return None, None
 
 class SnapshotIsolationStore(MVCCStore):
-    pass
+    def read(self, txn_id, key):
+        with self.lock:
+            txn_info = self.active_txns.get(txn_id)
+            if txn_info is None:
+                return None, 'transaction not active'
+
+            if key in txn_info['write_set']:
+                pending = txn_info['write_set'][key]
+                return (None if pending['deleted'] else pending['value']), None
+
+            read_cache = txn_info['read_cache']
+            if key in read_cache:
+                return read_cache[key], None
+
+            txn_info['read_set'].add(key)
+            value = self._get_visible_version(key, txn_id)
+            read_cache[key] = value
+            return value, None
 
 
@@ -2,6 +2,14 @@ import struct
 from schema import Schema, FieldType, SchemaRegistry
 from encoder import MAGIC, HEADER_FORMAT, HEADER_SIZE
 
+_FIXED = {
+    FieldType.INT32: struct.Struct('>i'),
+    FieldType.INT64: struct.Struct('>q'),
+    FieldType.FLOAT32: struct.Struct('>f'),
+    FieldType.FLOAT64: struct.Struct('>d'),
+    FieldType.BOOL: struct.Struct('>?'),
+}
+
 def decode_varint(data, offset):
     result = 0
     shift = 0
@@ -91,21 +99,9 @@ class Decoder:
     def _decode_value(self, data, offset, field_def):
         field_type = field_def.field_type
 
-        if field_type == FieldType.INT32:
-            value = struct.unpack('>i', data[offset:offset + 4])[0]
-            return value, offset + 4
-
-        if field_type == FieldType.INT64:
-            value = struct.unpack('>q', data[offset:offset + 8])[0]
-            return value, offset + 8
-
-        if field_type == FieldType.FLOAT32:
-            value = struct.unpack('>f', data[offset:offset + 4])[0]
-            return value, offset + 4
-
-        if field_type == FieldType.FLOAT64:
-            value = struct.unpack('>d', data[offset:offset + 8])[0]
-            return value, offset + 8
+        fixed = _FIXED.get(field_type)
+        if fixed is not None:
+            return fixed.unpack_from(data, offset)[0], offset + fixed.size
 
         if field_type == FieldType.STRING:
             return decode_string(data, offset)
@@ -113,10 +109,6 @@ class Decoder:
         if field_type == FieldType.BYTES:
             return decode_bytes(data, offset)
 
-        if field_type == FieldType.BOOL:
-            value = struct.unpack('>?', data[offset:offset + 1])[0]
-            return value, offset + 1
-
         if field_type == FieldType.ARRAY:
             count, offset = decode_varint(data, offset)
             items = []
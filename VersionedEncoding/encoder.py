@@ -1,114 +1,189 @@
 import struct
-from schema import Schema, FieldType
+from schema import Schema, FieldType, _PACKERS
 
 MAGIC = b'VENC'
 HEADER_FORMAT = '>4s H H'
 HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
 
+_ELEM_CODE = {
+    FieldType.INT32: 'i',
+    FieldType.INT64: 'q',
+    FieldType.FLOAT32: 'f',
+    FieldType.FLOAT64: 'd',
+    FieldType.BOOL: '?',
+}
+
+_MISSING = object()
+_U64_MASK = (1 << 64) - 1
+
+_SMALL_VARINT = [bytes([i]) for i in range(128)]
+
 def encode_varint(value):
-    result = []
-    if value < 0:
-        value = (1 << 64) + value
-    while value > 0x7f:
-        result.append((value & 0x7f) | 0x80)
+    if 0 <= value < 128:
+        return _SMALL_VARINT[value]
+    value &= _U64_MASK
+    n = (value.bit_length() + 6) // 7
+    result = bytearray(n)
+    for i in range(n - 1):
+        result[i] = (value & 0x7f) | 0x80
         value >>= 7
-    result.append(value)
+    result[n - 1] = value
     return bytes(result)
 
+def encode_varint_into(value, out):
+    if 0 <= value < 128:
+        out.append(value)
+        return 1
+    value &= _U64_MASK
+    n = 1
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+        n += 1
+    out.append(value)
+    return n
+
 def encode_string(s):
     encoded = s.encode('utf-8')
     return encode_varint(len(encoded)) + encoded
 
+def encode_string_into(s, out):
+    encoded = s.encode('utf-8')
+    n = len(encoded)
+    if n < 128:
+        out.append(n)
+    else:
+        encode_varint_into(n, out)
+    out += encoded
+
 def encode_bytes(b):
     return encode_varint(len(b)) + b
 
+def _header_prefix(schema):
+    key = (schema.name, schema.version)
+    cached = schema._header
+    if cached is None or cached[0] != key:
+        name = schema.name.encode('utf-8')
+        cached = schema._header = (key, struct.pack(HEADER_FORMAT, MAGIC, schema.version, len(name)) + name)
+    return cached[1]
+
+def _encode_fields(schema, data, out):
+    get = data.get
+    for name, tag, required, pack, field_def in schema._plan:
+        value = get(name, _MISSING)
+        if value is _MISSING:
+            if required:
+                raise ValueError(f'missing required field: {name}')
+            continue
+        if value is None:
+            continue
+
+        encode_varint_into(tag, out)
+        if pack is not None:
+            out += pack(value)
+        else:
+            _encode_value(value, field_def.field_type, field_def, out)
+
+    out.append(0)
+
+def _encode_value(value, field_type, field_def, out):
+    handler = _HANDLERS.get(field_type)
+    if handler is None:
+        raise ValueError(f'unknown field type: {field_type}')
+    handler(value, field_def, out)
+
+def _packed(pack):
+    def _enc_packed(value, field_def, out):
+        out += pack(value)
+    return _enc_packed
+
+def _enc_string(value, field_def, out):
+    encode_string_into(value, out)
+
+def _enc_bytes(value, field_def, out):
+    out += encode_bytes(value)
+
+def _enc_array(value, field_def, out):
+    encode_varint_into(len(value), out)
+    element_type = field_def.element_type if field_def else FieldType.STRING
+    code = _ELEM_CODE.get(element_type)
+    if code is not None:
+        out += struct.pack(f'>{len(value)}{code}', *value)
+        return
+    if element_type == FieldType.STRING:
+        parts = []
+        append = parts.append
+        for item in value:
+            encoded = item.encode('utf-8')
+            append(encode_varint(len(encoded)))
+            append(encoded)
+        out += b''.join(parts)
+        return
+    if element_type == FieldType.BYTES:
+        parts = []
+        append = parts.append
+        for item in value:
+            append(encode_varint(len(item)))
+            append(item)
+        out += b''.join(parts)
+        return
+    for item in value:
+        _encode_value(item, element_type, None, out)
+
+def _enc_map(value, field_def, out):
+    encode_varint_into(len(value), out)
+    for k, v in value.items():
+        encode_string_into(k if type(k) is str else str(k), out)
+        encode_string_into(v if type(v) is str else str(v), out)
+
+def _enc_nested(value, field_def, out):
+    if not (field_def and field_def.nested_schema):
+        out.append(0)
+        return
+    mark = len(out)
+    out.append(0)
+    _encode_fields(field_def.nested_schema, value, out)
+    length = len(out) - mark - 1
+    if length < 128:
+        out[mark] = length
+    else:
+        out[mark:mark + 1] = encode_varint(length)
+
+_HANDLERS = {field_type: _packed(pack) for field_type, pack in _PACKERS.items()}
+_HANDLERS.update({
+    FieldType.STRING: _enc_string,
+    FieldType.BYTES: _enc_bytes,
+    FieldType.ARRAY: _enc_array,
+    FieldType.MAP: _enc_map,
+    FieldType.NESTED: _enc_nested,
+})
+
 class Encoder:
     def __init__(self, schema):
         self.schema = schema
 
     def encode(self, data):
-        header = struct.pack(
-            HEADER_FORMAT,
-            MAGIC,
-            self.schema.version,
-            len(self.schema.name)
-        )
-        schema_name = self.schema.name.encode('utf-8')
-
-        body = self._encode_fields(data)
-
-        return header + schema_name + body
-
-    def _encode_fields(self, data):
-        result = bytearray()
-
-        for field_def in self.schema.fields:
-            if field_def.name not in data:
-                if field_def.required:
-                    raise ValueError(f'missing required field: {field_def.name}')
-                continue
+        out = bytearray(_header_prefix(self.schema))
+        _encode_fields(self.schema, data, out)
 
-            value = data[field_def.name]
-            if value is None:
-                continue
+        return bytes(out)
 
-            result.extend(encode_varint(field_def.tag))
-            result.extend(self._encode_value(value, field_def.field_type, field_def))
+    def encode_batch(self, records):
+        schema = self.schema
+        prefix = _header_prefix(schema)
+        out = bytearray()
+        offsets = []
+        for data in records:
+            offsets.append(len(out))
+            out += prefix
+            _encode_fields(schema, data, out)
 
-        result.extend(encode_varint(0))
-
-        return bytes(result)
-
-    def _encode_value(self, value, field_type, field_def=None):
-        if field_type == FieldType.INT32:
-            return struct.pack('>i', value)
-
-        if field_type == FieldType.INT64:
-            return struct.pack('>q', value)
-
-        if field_type == FieldType.FLOAT32:
-            return struct.pack('>f', value)
-
-        if field_type == FieldType.FLOAT64:
-            return struct.pack('>d', value)
-
-        if field_type == FieldType.STRING:
-            return encode_string(value)
-
-        if field_type == FieldType.BYTES:
-            return encode_bytes(value)
-
-        if field_type == FieldType.BOOL:
-            return struct.pack('>?', value)
-
-        if field_type == FieldType.ARRAY:
-            result = bytearray()
-            result.extend(encode_varint(len(value)))
-            element_type = field_def.element_type if field_def else FieldType.STRING
-            for item in value:
-                result.extend(self._encode_value(item, element_type))
-            return bytes(result)
-
-        if field_type == FieldType.MAP:
-            result = bytearray()
-            result.extend(encode_varint(len(value)))
-            for k, v in value.items():
-                result.extend(encode_string(str(k)))
-                result.extend(encode_string(str(v)))
-            return bytes(result)
-
-        if field_type == FieldType.NESTED:
-            if field_def and field_def.nested_schema:
-                nested_encoder = Encoder(field_def.nested_schema)
-                nested_data = nested_encoder._encode_fields(value)
-                return encode_varint(len(nested_data)) + nested_data
-            else:
-                return encode_bytes(b'')
-
-        raise ValueError(f'unknown field type: {field_type}')
+        return bytes(out), offsets
 
 def encode(schema, data):
     encoder = Encoder(schema)
     return encoder.encode(data)
 
-
+def encode_batch(schema, records):
+    encoder = Encoder(schema)
+    return encoder.encode_batch(records)
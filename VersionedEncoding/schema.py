@@ -1,3 +1,5 @@
+import bisect
+import struct
 from enum import IntEnum
 from dataclasses import dataclass, field
 from typing import Any, Optional
@@ -14,7 +16,42 @@ class FieldType(IntEnum):
     MAP = 9
     NESTED = 10
 
-@dataclass
+def _pack_bool(value):
+    return b'\x01' if value else b'\x00'
+
+_PACKERS = {
+    FieldType.INT32: struct.Struct('>i').pack,
+    FieldType.INT64: struct.Struct('>q').pack,
+    FieldType.FLOAT32: struct.Struct('>f').pack,
+    FieldType.FLOAT64: struct.Struct('>d').pack,
+    FieldType.BOOL: _pack_bool,
+}
+
+_TYPE_MAP = {
+    FieldType.INT32: int,
+    FieldType.INT64: int,
+    FieldType.FLOAT32: float,
+    FieldType.FLOAT64: float,
+    FieldType.STRING: str,
+    FieldType.BYTES: bytes,
+    FieldType.BOOL: bool,
+    FieldType.MAP: dict,
+    FieldType.NESTED: dict,
+}
+
+def _compile_check(field_type, element_type=None):
+    if field_type == FieldType.ARRAY:
+        if element_type:
+            check = _compile_check(element_type)
+            return lambda value: value is None or (isinstance(value, list) and all(map(check, value)))
+        return lambda value: value is None or isinstance(value, list)
+
+    expected = _TYPE_MAP.get(field_type)
+    if expected is None:
+        return lambda value: value is None
+    return lambda value: value is None or isinstance(value, expected)
+
+@dataclass(slots=True)
 class FieldDef:
     tag: int
     name: str
@@ -23,12 +60,31 @@ class FieldDef:
     default: Any = None
     element_type: Optional[FieldType] = None
     nested_schema: Optional['Schema'] = None
+    _pack: Any = field(default=None, init=False, repr=False, compare=False)
 
-@dataclass
+    def __post_init__(self):
+        self._pack = _PACKERS.get(self.field_type)
+
+@dataclass(slots=True)
 class Schema:
     name: str
     version: int
     fields: list = field(default_factory=list)
+    _header: Any = field(default=None, init=False, repr=False, compare=False)
+    _by_tag: dict = field(default_factory=dict, init=False, repr=False, compare=False)
+    _by_name: dict = field(default_factory=dict, init=False, repr=False, compare=False)
+    _plan: list = field(default_factory=list, init=False, repr=False, compare=False)
+    _checks: list = field(default_factory=list, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        for f in self.fields:
+            self._index_field(f)
+
+    def _index_field(self, f):
+        self._by_tag.setdefault(f.tag, f)
+        self._by_name.setdefault(f.name, f)
+        self._plan.append((f.name, f.tag, f.required, f._pack, f))
+        self._checks.append((f.name, f.required, _compile_check(f.field_type, f.element_type)))
 
     def add_field(self, tag, name, field_type, required=False, default=None,
                   element_type=None, nested_schema=None):
@@ -42,70 +98,34 @@ class Schema:
             nested_schema=nested_schema
         )
         self.fields.append(f)
+        self._index_field(f)
         return self
 
     def get_field_by_tag(self, tag):
-        for f in self.fields:
-            if f.tag == tag:
-                return f
-        return None
+        return self._by_tag.get(tag)
 
     def get_field_by_name(self, name):
-        for f in self.fields:
-            if f.name == name:
-                return f
-        return None
+        return self._by_name.get(name)
 
     def validate(self, data):
-        for f in self.fields:
-            if f.required and f.name not in data:
-                raise ValueError(f'missing required field: {f.name}')
-
-            if f.name in data:
-                value = data[f.name]
-                if not self._type_check(value, f.field_type, f.element_type):
-                    raise TypeError(f'invalid type for field {f.name}')
+        for name, required, check in self._checks:
+            if name in data:
+                if not check(data[name]):
+                    raise TypeError(f'invalid type for field {name}')
+            elif required:
+                raise ValueError(f'missing required field: {name}')
 
         return True
 
-    def _type_check(self, value, field_type, element_type=None):
-        if value is None:
-            return True
-
-        type_map = {
-            FieldType.INT32: int,
-            FieldType.INT64: int,
-            FieldType.FLOAT32: float,
-            FieldType.FLOAT64: float,
-            FieldType.STRING: str,
-            FieldType.BYTES: bytes,
-            FieldType.BOOL: bool,
-        }
-
-        if field_type in type_map:
-            return isinstance(value, type_map[field_type])
-
-        if field_type == FieldType.ARRAY:
-            if not isinstance(value, list):
-                return False
-            if element_type:
-                return all(self._type_check(v, element_type) for v in value)
-            return True
-
-        if field_type == FieldType.MAP:
-            return isinstance(value, dict)
-
-        if field_type == FieldType.NESTED:
-            return isinstance(value, dict)
-
-        return False
-
 class SchemaRegistry:
     def __init__(self):
         self.schemas = {}
+        self._versions = {}
 
     def register(self, schema):
         key = (schema.name, schema.version)
+        if key not in self.schemas:
+            bisect.insort(self._versions.setdefault(schema.name, []), schema.version)
         self.schemas[key] = schema
         return schema
 
@@ -113,13 +133,13 @@ class SchemaRegistry:
         return self.schemas.get((name, version))
 
     def get_latest(self, name):
-        matching = [(v, s) for (n, v), s in self.schemas.items() if n == name]
-        if not matching:
+        versions = self._versions.get(name)
+        if not versions:
             return None
-        return max(matching, key=lambda x: x[0])[1]
+        return self.schemas[(name, versions[-1])]
 
     def get_versions(self, name):
-        return sorted([v for (n, v) in self.schemas.keys() if n == name])
+        return list(self._versions.get(name, ()))
 
 def check_compatibility(old_schema, new_schema):
     issues = []
@@ -127,14 +147,14 @@ def check_compatibility(old_schema, new_schema):
     old_tags = {f.tag: f for f in old_schema.fields}
     new_tags = {f.tag: f for f in new_schema.fields}
 
-    for tag, old_field in old_tags.items():
-        if tag in new_tags:
-            new_field = new_tags[tag]
-            if old_field.field_type != new_field.field_type:
-                issues.append(f'type change for tag {tag}: {old_field.field_type} -> {new_field.field_type}')
+    for tag in sorted(old_tags.keys() & new_tags.keys()):
+        old_type, new_type = old_tags[tag].field_type, new_tags[tag].field_type
+        if old_type != new_type:
+            issues.append(f'type change for tag {tag}: {old_type} -> {new_type}')
 
-    for tag, new_field in new_tags.items():
-        if tag not in old_tags and new_field.required and new_field.default is None:
+    for tag in sorted(new_tags.keys() - old_tags.keys()):
+        new_field = new_tags[tag]
+        if new_field.required and new_field.default is None:
             issues.append(f'new required field without default: tag {tag} ({new_field.name})')
 
     return len(issues) == 0, issues